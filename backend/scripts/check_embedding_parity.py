@@ -0,0 +1,58 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.rag import ONNX_INT8_FILE, load_sentence_transformer  # noqa: E402
+
+model_name = os.environ["EMBEDDING_MODEL_NAME"]
+backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+min_similarity = float(os.getenv("EMBEDDING_PARITY_MIN", "0.99"))
+model_dir = os.path.join(os.path.dirname(__file__), "..", "models", model_name)
+model_dir = os.path.abspath(model_dir)
+
+SAMPLES = [
+    "Quarterly budget approval draft for the finance team",
+    "Analysis of regional climate trends over the last decade",
+    "Memorandum regarding the updated remote work policy",
+    "Player performance report for the 2024 season",
+    "Draft script for a short science fiction film",
+    "Export of user records with names, emails and job titles",
+    "How do I reset my password?",
+    "invoice",
+]
+
+
+def load(backend):
+    if backend == "onnx-int8" and not os.path.exists(
+        os.path.join(model_dir, ONNX_INT8_FILE)
+    ):
+        print(f"Missing {ONNX_INT8_FILE} in {model_dir}; run download_model.py.")
+        sys.exit(1)
+    return load_sentence_transformer(model_dir, backend)
+
+
+def encode(model):
+    return np.asarray(
+        model.encode(SAMPLES, normalize_embeddings=True, show_progress_bar=False),
+        dtype=np.float32,
+    )
+
+
+reference = encode(load("torch"))
+candidate = encode(load(backend))
+similarities = np.sum(reference * candidate, axis=1)
+
+print(f"Backend: {backend}")
+print(
+    f"Cosine similarity vs fp32: min={similarities.min():.5f}, "
+    f"mean={similarities.mean():.5f}"
+)
+
+if similarities.min() < min_similarity:
+    print(f"Parity check failed: minimum similarity below {min_similarity}.")
+    sys.exit(1)
+
+print("Parity check passed.")
@@ -1,6 +1,7 @@
 import os
 
 model_name = os.environ["EMBEDDING_MODEL_NAME"]
+backend = os.getenv("EMBEDDING_BACKEND", "torch").lower()
 model_dir = os.path.join(os.path.dirname(__file__), "..", "models", model_name)
 model_dir = os.path.abspath(model_dir)
 
@@ -13,3 +14,34 @@ if not os.path.exists(model_dir) or not os.listdir(model_dir):
     print("Model saved.")
 else:
     print(f"Model already downloaded in {model_dir}.")
+
+if backend in ("onnx", "onnx-int8"):
+    onnx_file = os.path.join(model_dir, "onnx", "model.onnx")
+    int8_file = os.path.join(model_dir, "onnx", "model_qint8_avx2.onnx")
+
+    if not os.path.exists(onnx_file):
+        from sentence_transformers import SentenceTransformer
+
+        print(f"Exporting {model_name} to ONNX ...")
+        model = SentenceTransformer(
+            model_dir,
+            backend="onnx",
+            model_kwargs={"provider": "CPUExecutionProvider"},
+        )
+        model.save_pretrained(model_dir)
+        print("ONNX model saved.")
+
+    if backend == "onnx-int8" and not os.path.exists(int8_file):
+        from sentence_transformers import (
+            SentenceTransformer,
+            export_dynamic_quantized_onnx_model,
+        )
+
+        print(f"Quantizing {model_name} ONNX model to int8 ...")
+        model = SentenceTransformer(
+            model_dir,
+            backend="onnx",
+            model_kwargs={"provider": "CPUExecutionProvider"},
+        )
+        export_dynamic_quantized_onnx_model(model, "avx2", model_dir)
+        print("Quantized ONNX model saved.")
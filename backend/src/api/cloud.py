@@ -1,11 +1,12 @@
-import zipfile
-from io import BytesIO
+import asyncio
+import hashlib
 from typing import List
 
+from beanie import PydanticObjectId
+from beanie.operators import In
 from bson import ObjectId
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
     Form,
     HTTPException,
@@ -16,15 +17,19 @@ from fastapi import File as FastAPIFile
 from fastapi.responses import JSONResponse, StreamingResponse
 from filetype import guess
 from pydantic import BaseModel, Field
+from pymongo.errors import BulkWriteError
 
 import src.utils.auth as auth
-from src.client import get_fs, get_redis_client
-from src.models import File, Folder, User
-from src.rag.ingest import ingest_file_to_redis
+from src.client import get_db, get_fs, get_redis_client
+from src.models import File, FileSummary, Folder, User, ref_id
+from src.rag.queue import ingest_queue
+from src.utils.blobs import BLOB_BLOCK_SIZE, acquire_blob, release_blobs, store_blob
 from src.utils.constants import (
     ALLOWED_MIME_TYPES,
+    BULK_UPLOAD_CONCURRENCY,
     DEFAULT_FOLDER,
     META_DATA_SIZE,
+    MIME_SNIFF_BYTES,
     STORAGE_QUOTA,
 )
 from src.utils.exceptions import (
@@ -32,10 +37,17 @@ from src.utils.exceptions import (
     raise_not_found,
     raise_storage_exceeded,
 )
+from src.utils.folder_paths import folder_path_of, resolve_folder_paths
+from src.utils.streaming import stream_zip
 
 router = APIRouter()
 
 
+async def iter_upload(file: UploadFile):
+    while block := await file.read(BLOB_BLOCK_SIZE):
+        yield block
+
+
 class BulkActionRequest(BaseModel):
     file_ids: List[str] = Field(default_factory=list)
     folder_ids: List[str] = Field(default_factory=list)
@@ -43,11 +55,11 @@ class BulkActionRequest(BaseModel):
 
 @router.post("/bulk/upload", status_code=status.HTTP_207_MULTI_STATUS)
 async def bulk_upload(
-    background_tasks: BackgroundTasks,
     files: List[UploadFile] = FastAPIFile(...),
     file_paths: List[str] = Form(...),
     parent_folder_id: str | None = Form(None),
     tags: List[str] = Form([]),
+    batch_id: str | None = Form(None),
     token=Depends(auth.verify_access_token_exclude_guests),
     fs=Depends(get_fs),
     r_client=Depends(get_redis_client),
@@ -66,23 +78,17 @@ async def bulk_upload(
     if not upload_root_folder:
         raise_not_found("Target folder")
 
-    owner = await upload_root_folder.owner.fetch()
-    if not owner or owner.id != current_user.id:
+    if ref_id(upload_root_folder.owner) != current_user.id:
         raise_access_denied()
 
-    total_upload_size = 0
-    file_contents_map = {}
-    unique_folder_paths = set()
-
-    for i, file in enumerate(files):
-        contents = await file.read()
-        file_contents_map[i] = contents
-        total_upload_size += len(contents)
-        path_parts = file_paths[i].split("/")
-        if len(path_parts) > 1:
-            for j in range(len(path_parts) - 1):
-                unique_folder_paths.add("/".join(path_parts[: j + 1]))
-
+    dir_paths = [folder_path_of(file_path) for file_path in file_paths]
+    unique_folder_paths = {
+        "/".join(dir_path.split("/")[: i + 1])
+        for dir_path in dir_paths
+        if dir_path
+        for i in range(dir_path.count("/") + 1)
+    }
+    total_upload_size = sum(file.size or 0 for file in files)
     total_upload_size += len(unique_folder_paths) * META_DATA_SIZE
     if current_user.used_storage + total_upload_size > STORAGE_QUOTA:
         raise_storage_exceeded()
@@ -90,79 +96,114 @@ async def bulk_upload(
     successful_uploads = []
     failed_uploads = []
     storage_to_add = 0
-    created_folders_cache = {}
 
-    for i, file in enumerate(files):
-        file_path = file_paths[i]
-        file_name = file.filename
-        contents = file_contents_map[i]
-        gridfs_id = None
+    folder_error = None
+    try:
+        folders, created_folders = await resolve_folder_paths(
+            upload_root_folder, current_user, dir_paths, batch_id
+        )
+        storage_to_add += len(created_folders) * META_DATA_SIZE
+    except Exception as e:
+        folders = {"": upload_root_folder}
+        folder_error = f"Failed to create folder: {e}"
 
-        try:
-            current_parent_folder = upload_root_folder
-            path_parts = file_path.split("/")
-            if len(path_parts) > 1:
-                folder_path_parts = path_parts[:-1]
-                cumulative_path = ""
-                for part in folder_path_parts:
-                    cumulative_path = (
-                        f"{cumulative_path}/{part}" if cumulative_path else part
-                    )
-
-                    if cumulative_path in created_folders_cache:
-                        current_parent_folder = created_folders_cache[cumulative_path]
-                    else:
-                        existing_folder = await Folder.find_one(
-                            Folder.name == part,
-                            Folder.owner.id == current_user.id,
-                            Folder.parent.id == current_parent_folder.id,
-                        )
-                        if existing_folder:
-                            current_parent_folder = existing_folder
-                        else:
-                            new_folder = Folder(
-                                name=part,
-                                owner=current_user,
-                                parent=current_parent_folder,
-                            )
-                            await new_folder.insert()
-                            storage_to_add += META_DATA_SIZE
-                            current_parent_folder = new_folder
-                            created_folders_cache[cumulative_path] = new_folder
-
-            kind = guess(contents)
+    db = get_db()
+    semaphore = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+
+    async def upload_one(file: UploadFile, dir_path: str):
+        folder = folders.get(dir_path)
+        if folder is None:
+            raise ValueError(folder_error or f"Folder {dir_path} not found")
+
+        async with semaphore:
+            head = await file.read(MIME_SNIFF_BYTES)
+            kind = guess(head)
             mime_type = kind.mime if kind else file.content_type
             if mime_type not in ALLOWED_MIME_TYPES:
                 raise ValueError(f"Unsupported file type: {mime_type}")
 
-            file_obj = BytesIO(contents)
-            gridfs_id = await fs.upload_from_stream(
-                file_name, file_obj, metadata={"contentType": mime_type}
-            )
+            content_hash = hashlib.sha256()
+            file_size = 0
+            block = head
+            while block:
+                content_hash.update(block)
+                file_size += len(block)
+                block = await file.read(BLOB_BLOCK_SIZE)
+            content_hash = content_hash.hexdigest()
+
+            gridfs_id = await acquire_blob(db, content_hash)
+            if gridfs_id is None:
+                await file.seek(0)
+                gridfs_id = await store_blob(
+                    fs, db, file.filename, content_hash, mime_type, iter_upload(file)
+                )
 
-            file_size = len(contents)
-            new_file = File(
-                file_name=file_name,
-                file_type=mime_type,
-                file_size=file_size,
-                owner=current_user,
-                folder=current_parent_folder,
-                tags=tags,
-                gridfs_id=str(gridfs_id),
-            )
-            await new_file.insert()
-            background_tasks.add_task(
-                ingest_file_to_redis, r_client, fs, str(new_file.id)
+        return File(
+            id=PydanticObjectId(),
+            file_name=file.filename,
+            file_type=mime_type,
+            file_size=file_size,
+            owner=current_user,
+            folder=folder,
+            tags=tags,
+            gridfs_id=gridfs_id,
+            content_hash=content_hash,
+        )
+
+    results = await asyncio.gather(
+        *(upload_one(file, dir_path) for file, dir_path in zip(files, dir_paths)),
+        return_exceptions=True,
+    )
+
+    new_files = []
+    for file, file_path, result in zip(files, file_paths, results):
+        if isinstance(result, Exception):
+            failed_uploads.append(
+                {"file_name": file.filename, "path": file_path, "error": str(result)}
             )
+        else:
+            new_files.append((file_path, result))
 
-            storage_to_add += file_size
-            successful_uploads.append({"file_name": file_name, "id": str(new_file.id)})
+    if new_files:
+        failed = {}
+        try:
+            await File.insert_many(
+                [new_file for _, new_file in new_files], ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = error.get("errmsg", str(e))
         except Exception as e:
-            if gridfs_id:
-                await fs.delete(gridfs_id)
-            failed_uploads.append(
-                {"file_name": file_name, "path": file_path, "error": str(e)}
+            inserted = await File.get_pymongo_collection().distinct(
+                "_id", {"_id": {"$in": [new_file.id for _, new_file in new_files]}}
             )
+            for index, (_, new_file) in enumerate(new_files):
+                if new_file.id not in inserted:
+                    failed[index] = str(e)
+
+        if failed:
+            await release_blobs(db, [new_files[index][1].gridfs_id for index in failed])
+            for index, error in failed.items():
+                file_path, new_file = new_files[index]
+                failed_uploads.append(
+                    {"file_name": new_file.file_name, "path": file_path, "error": error}
+                )
+            new_files = [
+                entry for index, entry in enumerate(new_files) if index not in failed
+            ]
+
+        await Folder.add_sizes(
+            [(new_file.folder, new_file.file_size) for _, new_file in new_files]
+        )
+
+    await ingest_queue.enqueue(
+        r_client, [str(new_file.id) for _, new_file in new_files]
+    )
+    for _, new_file in new_files:
+        storage_to_add += new_file.file_size
+        successful_uploads.append(
+            {"file_name": new_file.file_name, "id": str(new_file.id)}
+        )
 
     if storage_to_add > 0:
         await current_user.update({"$inc": {"used_storage": storage_to_add}})
@@ -183,61 +224,30 @@ async def bulk_download(
     fs=Depends(get_fs),
 ):
     token_data, current_user = token
-    zip_buffer = BytesIO()
 
-    async def add_folder_to_zip(
-        folder_id: str, archive: zipfile.ZipFile, base_path: str
-    ):
-        folder = await Folder.get(ObjectId(folder_id))
-        if not folder:
-            return
-
-        owner = await folder.owner.fetch()
-        if owner.id != current_user.id:
-            return
-
-        current_path = f"{base_path}{folder.name}/"
-
-        files_in_folder = await File.find(File.folder.id == folder.id).to_list()
-        for file_doc in files_in_folder:
-            if not file_doc.gridfs_id:
-                continue
-            try:
-                gridfs_file = await fs.open_download_stream(
-                    ObjectId(file_doc.gridfs_id)
-                )
-                file_content = await gridfs_file.read()
-                archive.writestr(f"{current_path}{file_doc.file_name}", file_content)
-            except Exception:
-                continue
-
-        sub_folders = await Folder.find(Folder.parent.id == folder.id).to_list()
-        for sub_folder in sub_folders:
-            await add_folder_to_zip(str(sub_folder.id), archive, current_path)
-
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as archive:
+    async def iter_entries():
         for file_id in payload.file_ids:
             file_doc = await File.get(ObjectId(file_id))
-            if not file_doc:
-                continue
-
-            owner = await file_doc.owner.fetch()
-            if owner.id == current_user.id and file_doc.gridfs_id:
-                try:
-                    gridfs_file = await fs.open_download_stream(
-                        ObjectId(file_doc.gridfs_id)
-                    )
-                    file_content = await gridfs_file.read()
-                    archive.writestr(file_doc.file_name, file_content)
-                except Exception:
-                    continue
+            if file_doc and ref_id(file_doc.owner) == current_user.id:
+                yield file_doc.file_name, file_doc
 
         for folder_id in payload.folder_ids:
-            await add_folder_to_zip(folder_id, archive, "")
+            folder = await Folder.get(ObjectId(folder_id))
+            if not folder or ref_id(folder.owner) != current_user.id:
+                continue
+
+            folder_paths = await folder.subtree_paths()
+            files_in_folders = (
+                await File.find(In(File.folder.id, list(folder_paths)))
+                .project(FileSummary)
+                .to_list()
+            )
+            for file_doc in files_in_folders:
+                current_path = folder_paths[ref_id(file_doc.folder)]
+                yield f"{current_path}{file_doc.file_name}", file_doc
 
-    zip_buffer.seek(0)
     return StreamingResponse(
-        zip_buffer,
+        stream_zip(fs, iter_entries()),
         media_type="application/zip",
         headers={"Content-Disposition": "attachment; filename=download.zip"},
     )
@@ -260,8 +270,7 @@ async def bulk_delete(
             if not folder:
                 raise_not_found(Folder.__name__)
 
-            owner = await folder.owner.fetch()
-            if not owner or owner.id != current_user.id:
+            if ref_id(folder.owner) != current_user.id:
                 raise_access_denied()
 
             if folder.name == "Home" and folder.parent is None:
@@ -283,8 +292,7 @@ async def bulk_delete(
             if not file_doc:
                 raise_not_found(File.__name__)
 
-            owner = await file_doc.owner.fetch()
-            if not owner or owner.id != current_user.id:
+            if ref_id(file_doc.owner) != current_user.id:
                 raise_access_denied()
 
             storage = file_doc.file_size
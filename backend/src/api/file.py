@@ -1,18 +1,19 @@
 import urllib.parse
-from io import BytesIO
 
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, constr
 
 import src.utils.auth as auth
-from src.client import get_fs
-from src.models import File
+from src.client import get_fs, get_redis_client
+from src.models import File, ref_id
+from src.rag.queue import ingest_queue
 from src.utils.exceptions import (
     raise_access_denied,
     raise_not_found,
 )
+from src.utils.streaming import etag_matches, iter_gridfs_file, parse_byte_range
 
 router = APIRouter()
 
@@ -26,20 +27,16 @@ async def edit_file(
     file_id: str,
     payload: RenameRequest,
     token=Depends(auth.verify_access_token_exclude_guests),
-    fs=Depends(get_fs),
 ):
     token_data, current_user = token
     file_doc = await File.get(ObjectId(file_id))
     if not (file_doc and file_doc.gridfs_id):
         raise_not_found(File.__name__)
 
-    owner = await file_doc.owner.fetch()
-    if owner.id != current_user.id:
+    if ref_id(file_doc.owner) != current_user.id:
         raise_access_denied()
 
     try:
-        await fs.rename(ObjectId(file_doc.gridfs_id), payload.name)
-
         file_doc.file_name = payload.name
         await file_doc.save()
 
@@ -56,21 +53,33 @@ async def edit_file(
 
 @router.get("/file/{file_id}", status_code=status.HTTP_200_OK)
 async def get_file(
-    file_id: str, token=Depends(auth.verify_access_token), fs=Depends(get_fs)
+    file_id: str,
+    request: Request,
+    token=Depends(auth.verify_access_token),
+    fs=Depends(get_fs),
 ):
     token_data, current_user = token
     file_doc = await File.get(ObjectId(file_id))
     if not (file_doc and file_doc.gridfs_id):
         raise_not_found(File.__name__)
 
-    owner = await file_doc.owner.fetch()
-    if owner.id != current_user.id:
+    if ref_id(file_doc.owner) != current_user.id:
         raise_access_denied()
 
-    buffer = BytesIO()
+    encoded_filename = urllib.parse.quote(file_doc.file_name)
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+    }
+    etag = f'"{file_doc.content_hash}"' if file_doc.content_hash else None
+    if etag:
+        headers["ETag"] = etag
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
     try:
-        await fs.download_to_stream(ObjectId(file_doc.gridfs_id), buffer)
-        buffer.seek(0)
+        grid_out = await fs.open_download_stream(ObjectId(file_doc.gridfs_id))
     except Exception as e:
         from src import logger
 
@@ -80,16 +89,51 @@ async def get_file(
             detail="Error while loading file",
         )
 
-    encoded_filename = urllib.parse.quote(file_doc.file_name)
+    size = grid_out.length
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range == etag:
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+    else:
+        start, end = 0, None
+        headers["Content-Length"] = str(size)
+        status_code = status.HTTP_200_OK
+
     return StreamingResponse(
-        buffer,
+        iter_gridfs_file(grid_out, start, end),
+        status_code=status_code,
         media_type=file_doc.file_type or "application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
-        },
+        headers=headers,
     )
 
 
+@router.get("/file/{file_id}/ingest", status_code=status.HTTP_200_OK)
+async def get_ingest_status(
+    file_id: str,
+    token=Depends(auth.verify_access_token),
+    r_client=Depends(get_redis_client),
+):
+    token_data, current_user = token
+    file_doc = await File.get(ObjectId(file_id))
+    if not file_doc:
+        raise_not_found(File.__name__)
+
+    if ref_id(file_doc.owner) != current_user.id:
+        raise_access_denied()
+
+    ingest_status = await ingest_queue.status(r_client, file_id)
+    if ingest_status is None:
+        ingest_status = {"state": "done" if file_doc.embedding else "unknown"}
+
+    return {"id": file_id, **ingest_status}
+
+
 @router.delete("/file/{file_id}", status_code=status.HTTP_200_OK)
 async def delete_file(
     file_id: str,
@@ -101,14 +145,13 @@ async def delete_file(
     if not (file_doc and file_doc.gridfs_id):
         raise_not_found(File.__name__)
 
-    owner = await file_doc.owner.fetch()
-    if owner.id != current_user.id:
+    if ref_id(file_doc.owner) != current_user.id:
         raise_access_denied()
 
     try:
-        owner.used_storage -= file_doc.file_size
+        current_user.used_storage -= file_doc.file_size
         await file_doc.delete()
-        await owner.save()
+        await current_user.save()
     except Exception as e:
         from src import logger
 
@@ -1,7 +1,6 @@
-import zipfile
-from io import BytesIO
 from math import ceil
 
+from beanie.operators import In
 from bson import DBRef, ObjectId
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import StreamingResponse
@@ -9,13 +8,15 @@ from pydantic import BaseModel, constr
 
 import src.utils.auth as auth
 from src.client import get_fs
-from src.models import File, Folder, User
+from src.models import File, FileSummary, Folder, FolderSummary, User, ref_id
 from src.utils.constants import DEFAULT_FOLDER, META_DATA_SIZE, STORAGE_QUOTA
+from src.utils.db_oprs.migrate_data import reconcile_folder_sizes
 from src.utils.exceptions import (
     raise_access_denied,
     raise_not_found,
     raise_storage_exceeded,
 )
+from src.utils.streaming import stream_zip
 
 router = APIRouter()
 
@@ -42,8 +43,7 @@ async def add_folder(
     if not parent:
         raise_not_found(Folder.__name__)
 
-    user = await parent.owner.fetch()
-    if not user or user.id != current_user.id:
+    if ref_id(parent.owner) != current_user.id:
         raise_access_denied()
 
     new_usage = current_user.used_storage + META_DATA_SIZE
@@ -77,8 +77,7 @@ async def edit_file(
     if not folder:
         raise_not_found(Folder.__name__)
 
-    owner = await folder.owner.fetch()
-    if owner.id != current_user.id:
+    if ref_id(folder.owner) != current_user.id:
         raise_access_denied()
 
     try:
@@ -96,6 +95,16 @@ async def edit_file(
         )
 
 
+@router.post("/folder/reconcile-sizes", status_code=status.HTTP_200_OK)
+async def reconcile_sizes(token=Depends(auth.verify_access_token)):
+    token_data, current_user = token
+    if current_user.role != "admin":
+        raise_access_denied()
+
+    drifted = await reconcile_folder_sizes()
+    return {"message": f"Reconciled folder sizes on {drifted} folder(s)"}
+
+
 @router.get("/folder", status_code=status.HTTP_200_OK)
 @router.get("/folder/{folder_id}", status_code=status.HTTP_200_OK)
 async def get_folder_contents(
@@ -118,8 +127,7 @@ async def get_folder_contents(
     if not folder:
         raise_not_found(Folder.__name__)
 
-    owner = await folder.owner.fetch()
-    if owner.id != current_user.id:
+    if ref_id(folder.owner) != current_user.id:
         raise_access_denied()
 
     skip = (page - 1) * limit
@@ -131,17 +139,25 @@ async def get_folder_contents(
     total_files = await files_query.count()
     total_items = total_folders + total_files
 
-    sub_folders = await sub_folders_query.skip(skip).limit(limit).to_list()
+    sub_folders = (
+        await sub_folders_query.skip(skip).limit(limit).project(FolderSummary).to_list()
+    )
 
     remaining_limit = limit - len(sub_folders)
     files_skip = max(0, skip - total_folders)
 
     files = []
     if remaining_limit > 0:
-        files = await files_query.skip(files_skip).limit(remaining_limit).to_list()
+        files = (
+            await files_query.skip(files_skip)
+            .limit(remaining_limit)
+            .project(FileSummary)
+            .to_list()
+        )
 
     folder_dict = await folder._to_dict(include_refs=False, include_parents=True)
-    folder_dict["sub_folders"] = [await f._to_dict() for f in sub_folders]
+    parent_dict = dict(folder_dict)
+    folder_dict["sub_folders"] = [await f._to_dict(parent_dict) for f in sub_folders]
     folder_dict["files"] = [await f._to_dict() for f in files]
 
     return {
@@ -160,40 +176,21 @@ async def download_folder(
     if not folder:
         raise_not_found(Folder.__name__)
 
-    owner = await folder.owner.fetch()
-    if owner.id != current_user.id:
+    if ref_id(folder.owner) != current_user.id:
         raise_access_denied()
 
-    zip_buffer = BytesIO()
-
-    async def add_folder_to_zip(
-        target_folder: Folder, archive: zipfile.ZipFile, base_path: str
-    ):
-        current_path = f"{base_path}{target_folder.name}/"
-
-        files_in_folder = await File.find(File.folder.id == target_folder.id).to_list()
-        for file_doc in files_in_folder:
-            if not file_doc.gridfs_id:
-                continue
-            try:
-                gridfs_file = await fs.open_download_stream(
-                    ObjectId(file_doc.gridfs_id)
-                )
-                file_content = await gridfs_file.read()
-                archive.writestr(f"{current_path}{file_doc.file_name}", file_content)
-            except Exception:
-                continue
-
-        sub_folders = await Folder.find(Folder.parent.id == target_folder.id).to_list()
-        for sub_folder in sub_folders:
-            await add_folder_to_zip(sub_folder, archive, current_path)
-
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as archive:
-        await add_folder_to_zip(folder, archive, "")
-
-    zip_buffer.seek(0)
+    async def iter_entries():
+        folder_paths = await folder.subtree_paths()
+        files = (
+            await File.find(In(File.folder.id, list(folder_paths)))
+            .project(FileSummary)
+            .to_list()
+        )
+        for file_doc in files:
+            yield f"{folder_paths[ref_id(file_doc.folder)]}{file_doc.file_name}", file_doc
+
     return StreamingResponse(
-        zip_buffer,
+        stream_zip(fs, iter_entries()),
         media_type="application/zip",
         headers={"Content-Disposition": f"attachment; filename={folder.name}.zip"},
     )
@@ -208,8 +205,7 @@ async def delete_folder(
     if not folder:
         raise_not_found(Folder.__name__)
 
-    owner = await folder.owner.fetch()
-    if owner.id != current_user.id:
+    if ref_id(folder.owner) != current_user.id:
         raise_access_denied()
 
     if folder.name == DEFAULT_FOLDER and folder.parent is None:
@@ -217,9 +213,9 @@ async def delete_folder(
 
     try:
         storage_freed = await folder.calculate_total_size()
-        owner.used_storage -= storage_freed
+        current_user.used_storage -= storage_freed
         await folder.delete()
-        await owner.save()
+        await current_user.save()
     except Exception as e:
         from src import logger
 
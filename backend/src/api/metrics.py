@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, status
+
+import src.utils.auth as auth
+from src.client import get_redis_client
+from src.rag import encoder, local_store, query_cache, scheduler
+from src.rag.queue import ingest_queue
+from src.utils.exceptions import raise_access_denied
+
+router = APIRouter()
+
+
+@router.get("/metrics/embedding", status_code=status.HTTP_200_OK)
+async def embedding_metrics(
+    token=Depends(auth.verify_access_token), r_client=Depends(get_redis_client)
+):
+    token_data, current_user = token
+    if current_user.role != "admin":
+        raise_access_denied()
+
+    return {
+        "model": encoder.stats(),
+        "scheduler": scheduler.stats(),
+        "query_cache": query_cache.stats(),
+        "local_store": local_store.stats(),
+        "ingest_queue": await ingest_queue.stats(r_client),
+    }
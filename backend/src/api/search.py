@@ -8,11 +8,12 @@ from numpy import float32
 from redis.exceptions import RedisError
 
 import src.utils.auth as auth
-from src.client import get_fs, get_redis_client
-from src.models import File, Folder, User
-from src.rag import encode_query, sample_text_chunks
+from src.client import get_redis_client
+from src.models import File, FileSummary, Folder, FolderSummary, RefResolver, User
+from src.rag import SEARCH_FALLBACK, encode_query, sample_text_chunks
 from src.rag.ingest import sync_files_to_redis
 from src.rag.search import (
+    perform_local_search,
     perform_mongodb_search,
     perform_redis_search,
 )
@@ -25,22 +26,31 @@ async def search_files_and_folders(q: str, token=Depends(auth.verify_access_toke
     token_data, current_user = token
     regex = re.compile(q, re.IGNORECASE)
 
-    folders = await Folder.find(
-        Folder.name == regex, Folder.owner == DBRef(User.__name__, current_user.id)
-    ).to_list()
-
-    files = await File.find(
-        File.file_name == regex, File.owner == DBRef(User.__name__, current_user.id)
-    ).to_list()
+    folders = (
+        await Folder.find(
+            Folder.name == regex,
+            Folder.owner == DBRef(User.__name__, current_user.id),
+        )
+        .project(FolderSummary)
+        .to_list()
+    )
+
+    files = (
+        await File.find(
+            File.file_name == regex,
+            File.owner == DBRef(User.__name__, current_user.id),
+        )
+        .project(FileSummary)
+        .to_list()
+    )
+
+    refs = RefResolver()
+    await refs.load_for_folders(folders)
+    await refs.load_for_files(files)
 
     result = {}
-    result["folders"] = []
-    for folder in folders:
-        result["folders"].append(await folder._to_dict())
-
-    result["files"] = []
-    for file in files:
-        result["files"].append(await file._to_dict(include_refs=True))
+    result["folders"] = [refs.folder_dict(folder.id) for folder in folders]
+    result["files"] = [refs.file_dict(file) for file in files]
 
     return result
 
@@ -50,60 +60,79 @@ async def ai_search(
     q: str,
     background_tasks: BackgroundTasks,
     token=Depends(auth.verify_access_token),
-    fs=Depends(get_fs),
 ):
     token_data, current_user = token
     file_docs = []
     score_map = {}
+    offsets_map = {}
     chunks = sample_text_chunks(q)
-    embedding = await encode_query(chunks)
-    embedding_bytes = embedding.astype(float32).tobytes()
+    embedding = (await encode_query(chunks)).mean(axis=0).astype(float32)
+    embedding_bytes = embedding.tobytes()
     use_hash = True
 
     try:
-        search_results = await perform_redis_search(embedding_bytes)
+        search_results = await perform_redis_search(
+            embedding_bytes, str(current_user.id)
+        )
         if search_results:
             score_map = {res["hash"]: res["score"] for res in search_results}
+            offsets_map = {res["hash"]: res["offsets"] for res in search_results}
             content_hashes = list(score_map.keys())
 
-            file_docs = await File.find(
-                In(File.content_hash, content_hashes),
-                File.owner == DBRef(User.__name__, current_user.id),
-            ).to_list()
+            file_docs = (
+                await File.find(
+                    In(File.content_hash, content_hashes),
+                    File.owner == DBRef(User.__name__, current_user.id),
+                )
+                .project(FileSummary)
+                .to_list()
+            )
 
     except RedisError as e:
         from src import logger
 
-        logger.warning(f"Redis search failed, falling back to MongoDB: {e}")
+        logger.warning(f"Redis search failed, falling back to {SEARCH_FALLBACK}: {e}")
         use_hash = False
-        search_results = await perform_mongodb_search(embedding, current_user)
+        if SEARCH_FALLBACK == "atlas":
+            search_results = await perform_mongodb_search(embedding, current_user)
+        else:
+            search_results = await perform_local_search(embedding, current_user)
         if search_results:
             score_map = {res["id"]: res["score"] for res in search_results}
             result_ids = list(score_map.keys())
 
-            file_docs = await File.find(
-                In(File.id, [ObjectId(id) for id in result_ids]),
-                File.owner == DBRef(User.__name__, current_user.id),
-            ).to_list()
+            file_docs = (
+                await File.find(
+                    In(File.id, [ObjectId(id) for id in result_ids]),
+                    File.owner == DBRef(User.__name__, current_user.id),
+                )
+                .project(FileSummary)
+                .to_list()
+            )
 
             sync_ids = [str(doc.id) for doc in file_docs]
             r_client = get_redis_client()
-            background_tasks.add_task(sync_files_to_redis, r_client, fs, sync_ids)
+            background_tasks.add_task(sync_files_to_redis, r_client, sync_ids)
 
     if not file_docs:
         return {"files": [], "folders": []}
 
+    refs = RefResolver()
+    await refs.load_for_files(file_docs)
+
     files_as_dicts = []
     min_score = float("inf")
     max_score = float("-inf")
 
     for doc in file_docs:
-        file_dict = await doc._to_dict(include_refs=True)
+        file_dict = refs.file_dict(doc)
         doc_id_str = file_dict["id"]
         lookup_key = doc.content_hash if use_hash else doc_id_str
         score = score_map.get(lookup_key, 0)
 
         file_dict["score"] = score
+        if use_hash:
+            file_dict["match_offsets"] = offsets_map.get(lookup_key, [])
         if score > 0:
             if score < min_score:
                 min_score = score
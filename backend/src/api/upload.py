@@ -1,8 +1,8 @@
+import hashlib
 import shutil
 
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
     Form,
     HTTPException,
@@ -16,13 +16,15 @@ from filetype import guess
 from pydantic import BaseModel
 
 import src.utils.auth as auth
-from src.client import get_fs, get_redis_client
-from src.models import File, Folder
-from src.rag.ingest import ingest_file_to_redis
+from src.client import get_db, get_fs, get_redis_client
+from src.models import File, Folder, ref_id
+from src.rag.queue import ingest_queue
+from src.utils.blobs import BLOB_BLOCK_SIZE, acquire_blob, release_blobs, store_blob
 from src.utils.constants import (
     ALLOWED_MIME_TYPES,
     DEFAULT_FOLDER,
     META_DATA_SIZE,
+    MIME_SNIFF_BYTES,
     STORAGE_QUOTA,
     TEMP_UPLOAD_DIR,
 )
@@ -31,16 +33,30 @@ from src.utils.exceptions import (
     raise_not_found,
     raise_storage_exceeded,
 )
+from src.utils.folder_paths import folder_path_of, resolve_folder_paths
 
 router = APIRouter()
 
 
+def iter_chunk_blocks(chunk_paths):
+    for chunk_path in chunk_paths:
+        with open(chunk_path, "rb") as chunk_file:
+            while block := chunk_file.read(BLOB_BLOCK_SIZE):
+                yield block
+
+
+async def iter_chunk_blocks_async(chunk_paths):
+    for block in iter_chunk_blocks(chunk_paths):
+        yield block
+
+
 class FinalizeRequest(BaseModel):
     upload_id: str
     file_name: str
     total_chunks: int
     parent_folder_id: str | None
     file_path: str
+    batch_id: str | None = None
 
 
 @router.post("/upload/chunk", status_code=status.HTTP_200_OK)
@@ -62,7 +78,6 @@ async def upload_chunk(
 @router.post("/upload/finalize", status_code=status.HTTP_201_CREATED)
 async def finalize_upload(
     payload: FinalizeRequest,
-    background_tasks: BackgroundTasks,
     token=Depends(auth.verify_access_token_exclude_guests),
     fs=Depends(get_fs),
     r_client=Depends(get_redis_client),
@@ -88,65 +103,50 @@ async def finalize_upload(
     if not upload_root_folder:
         raise_not_found("Target folder")
 
-    owner = await upload_root_folder.owner.fetch()
-    if not owner or owner.id != current_user.id:
+    if ref_id(upload_root_folder.owner) != current_user.id:
         raise_access_denied()
 
-    final_path = chunk_dir / payload.file_name
-    with open(final_path, "wb") as final_file:
-        for i in range(payload.total_chunks):
-            chunk_path = chunk_dir / f"{i}.chunk"
-            with open(chunk_path, "rb") as chunk_file:
-                final_file.write(chunk_file.read())
-
-    file_size = final_path.stat().st_size
+    chunk_paths = [chunk_dir / f"{i}.chunk" for i in range(payload.total_chunks)]
+    file_size = sum(chunk_path.stat().st_size for chunk_path in chunk_paths)
     if current_user.used_storage + file_size > STORAGE_QUOTA:
         raise_storage_exceeded()
 
     gridfs_id = None
     storage_to_add = 0
-    created_folders_cache = {}
 
     try:
-        current_parent_folder = upload_root_folder
-        path_parts = payload.file_path.split("/")
-        if len(path_parts) > 1:
-            folder_path_parts = path_parts[:-1]
-            cumulative_path = ""
-            for part in folder_path_parts:
-                cumulative_path = (
-                    f"{cumulative_path}/{part}" if cumulative_path else part
-                )
-                if cumulative_path in created_folders_cache:
-                    current_parent_folder = created_folders_cache[cumulative_path]
-                else:
-                    existing_folder = await Folder.find_one(
-                        Folder.name == part,
-                        Folder.owner.id == current_user.id,
-                        Folder.parent.id == current_parent_folder.id,
-                    )
-                    if existing_folder:
-                        current_parent_folder = existing_folder
-                    else:
-                        new_folder = Folder(
-                            name=part,
-                            owner=current_user,
-                            parent=current_parent_folder,
-                        )
-                        await new_folder.insert()
-                        storage_to_add += META_DATA_SIZE
-                        current_parent_folder = new_folder
-                    created_folders_cache[cumulative_path] = current_parent_folder
-
-        with open(final_path, "rb") as f:
-            contents = f.read()
-            kind = guess(contents)
-            mime_type = kind.mime if kind else "application/octet-stream"
-            if mime_type not in ALLOWED_MIME_TYPES:
-                raise ValueError(f"Unsupported file type: {mime_type}")
-
-            gridfs_id = await fs.upload_from_stream(
-                payload.file_name, contents, metadata={"contentType": mime_type}
+        folders, created_folders = await resolve_folder_paths(
+            upload_root_folder,
+            current_user,
+            [folder_path_of(payload.file_path)],
+            payload.batch_id,
+        )
+        storage_to_add += len(created_folders) * META_DATA_SIZE
+        current_parent_folder = folders[folder_path_of(payload.file_path)]
+
+        with open(chunk_paths[0], "rb") as first_chunk:
+            kind = guess(first_chunk.read(MIME_SNIFF_BYTES))
+        mime_type = kind.mime if kind else "application/octet-stream"
+        if mime_type not in ALLOWED_MIME_TYPES:
+            raise ValueError(f"Unsupported file type: {mime_type}")
+
+        content_hash = hashlib.sha256()
+        file_size = 0
+        for block in iter_chunk_blocks(chunk_paths):
+            content_hash.update(block)
+            file_size += len(block)
+        content_hash = content_hash.hexdigest()
+
+        db = get_db()
+        gridfs_id = await acquire_blob(db, content_hash)
+        if gridfs_id is None:
+            gridfs_id = await store_blob(
+                fs,
+                db,
+                payload.file_name,
+                content_hash,
+                mime_type,
+                iter_chunk_blocks_async(chunk_paths),
             )
 
         new_file = File(
@@ -155,15 +155,17 @@ async def finalize_upload(
             file_size=file_size,
             owner=current_user,
             folder=current_parent_folder,
-            gridfs_id=str(gridfs_id),
+            gridfs_id=gridfs_id,
+            content_hash=content_hash,
         )
         await new_file.insert()
+        gridfs_id = None
 
         storage_to_add += file_size
         if storage_to_add > 0:
             await current_user.update({"$inc": {"used_storage": storage_to_add}})
 
-        background_tasks.add_task(ingest_file_to_redis, r_client, fs, str(new_file.id))
+        await ingest_queue.enqueue(r_client, [str(new_file.id)])
 
         return {
             "successful_uploads": [
@@ -172,7 +174,7 @@ async def finalize_upload(
         }
     except Exception as e:
         if gridfs_id:
-            await fs.delete(gridfs_id)
+            await release_blobs(get_db(), [gridfs_id])
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail={
@@ -13,24 +13,24 @@ async def init_search_index(env: SimpleNamespace):
     logger = logging.getLogger("uvicorn")
     collection_name = File.__name__
 
+    # binary float32 embeddings are only indexed by "vector" fields
     update_body = {
         "definition": {
-            "mappings": {
-                "dynamic": False,
-                "fields": {
-                    "owner": {"type": "document", "dynamic": True},
-                    "embedding": {
-                        "type": "knnVector",
-                        "dimensions": EMB_DIM,
-                        "similarity": "euclidean",
-                    },
+            "fields": [
+                {
+                    "type": "vector",
+                    "path": "embedding",
+                    "numDimensions": EMB_DIM,
+                    "similarity": "euclidean",
                 },
-            }
+                {"type": "filter", "path": "owner.$id"},
+            ]
         }
     }
 
     create_body = {
         "name": INDEX_NAME,
+        "type": "vectorSearch",
         "database": env.DB_NAME,
         "collectionName": collection_name,
         "definition": update_body["definition"],
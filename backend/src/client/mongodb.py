@@ -7,6 +7,7 @@ from pymongo import AsyncMongoClient
 from pymongo.asynchronous.database import AsyncDatabase
 
 from src.models import File, Folder, JWTToken, User
+from src.utils.blobs import init_blob_index
 
 mongo_client: Optional[AsyncMongoClient] = None
 db: Optional[AsyncDatabase] = None
@@ -20,6 +21,7 @@ async def init_db(uri: str, db_name: str):
         db = AsyncDatabase(mongo_client, db_name)
         fs = AsyncGridFSBucket(db)
         await init_beanie(database=db, document_models=[User, File, Folder, JWTToken])
+        await init_blob_index(db)
     except Exception as e:
         logger = logging.getLogger("uvicorn")
         logger.error(f"Could not connect to MongoDB: {e}")
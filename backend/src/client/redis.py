@@ -1,4 +1,6 @@
+import asyncio
 import logging
+from hashlib import sha1
 from os import getenv
 from types import SimpleNamespace
 from typing import Optional
@@ -6,12 +8,25 @@ from typing import Optional
 from redis.asyncio import ConnectionPool, Redis
 from redis.exceptions import ConnectionError, ResponseError
 
-from src.rag import DOC_PREFIX, EMB_DIM, INDEX_NAME
+from src.rag import (
+    CHUNK_INDEX_NAME,
+    CHUNK_PREFIX,
+    EMB_DIM,
+    FLAT_BLOCK_SIZE,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_M,
+    INDEX_MIGRATION_TIMEOUT,
+    INDEX_NAME,
+    VECTOR_ALGORITHM,
+    VECTOR_ALGORITHMS,
+    VECTOR_INITIAL_CAP,
+)
 
 redis_client: Optional[Redis] = None
+index_swap_task: Optional[asyncio.Task] = None
 
 
-async def drop_redis_index(logger):
+async def drop_redis_index(logger, index_name=CHUNK_INDEX_NAME):
     global redis_client
 
     if not redis_client:
@@ -19,42 +34,153 @@ async def drop_redis_index(logger):
         return
 
     try:
-        await redis_client.execute_command("FT.DROPINDEX", INDEX_NAME, "DD")
-        logger.info(f"Redis Search index '{INDEX_NAME}' dropped successfully.")
+        await redis_client.execute_command("FT.DROPINDEX", index_name, "DD")
+        logger.info(f"Redis Search index '{index_name}' dropped successfully.")
     except ResponseError as e:
         if "Unknown Index name" in str(e):
-            logger.info(f"Redis Search index '{INDEX_NAME}' does not exist.")
+            logger.info(f"Redis Search index '{index_name}' does not exist.")
         else:
             logger.error(f"Failed to drop Redis Search index: {e}")
             raise
 
 
+def _chunk_index_schema(env: str) -> list:
+    vector_params = ["TYPE", "FLOAT32", "DIM", EMB_DIM, "DISTANCE_METRIC", "L2"]
+    if VECTOR_ALGORITHM == "FLAT":
+        if FLAT_BLOCK_SIZE:
+            vector_params += ["BLOCK_SIZE", FLAT_BLOCK_SIZE]
+    else:
+        vector_params += ["M", HNSW_M, "EF_CONSTRUCTION", HNSW_EF_CONSTRUCTION]
+    if VECTOR_INITIAL_CAP:
+        vector_params += ["INITIAL_CAP", VECTOR_INITIAL_CAP]
+
+    return [
+        "SCHEMA",
+        "parent",
+        "TAG",
+        "owners",
+        "TAG",
+        "embedding" + "_" + env,
+        "VECTOR",
+        VECTOR_ALGORITHM,
+        len(vector_params),
+        *vector_params,
+    ]
+
+
+def _chunk_index_version(schema: list) -> str:
+    return sha1(" ".join(map(str, schema)).encode("utf-8")).hexdigest()[:8]
+
+
+async def _get_index_info(name: str) -> Optional[dict]:
+    try:
+        raw_info = await redis_client.execute_command("FT.INFO", name)
+    except ResponseError as e:
+        if "Unknown" in str(e) or "no such index" in str(e):
+            return None
+        raise
+
+    return {
+        (key.decode("utf-8") if isinstance(key, bytes) else key): value
+        for key, value in zip(raw_info[::2], raw_info[1::2])
+    }
+
+
+async def _swap_chunk_index(logger, index_name: str, current: Optional[str]):
+    waited = 0
+    while True:
+        info = await _get_index_info(index_name)
+        if info and int(info.get("indexing", 0)) == 0:
+            break
+        if waited >= INDEX_MIGRATION_TIMEOUT:
+            logger.error(
+                f"Redis Search index '{index_name}' did not finish backfilling in "
+                f"{INDEX_MIGRATION_TIMEOUT}s; keeping '{current}'."
+            )
+            return
+
+        if info and waited % 30 == 0:
+            percent = float(info.get("percent_indexed", 0)) * 100
+            logger.info(f"Backfilling '{index_name}': {percent:.1f}% indexed.")
+        await asyncio.sleep(2)
+        waited += 2
+
+    try:
+        if current == CHUNK_INDEX_NAME:
+            # a pre-versioning index owns the alias name, so it has to go first
+            await redis_client.execute_command("FT.DROPINDEX", current)
+            await redis_client.execute_command(
+                "FT.ALIASADD", CHUNK_INDEX_NAME, index_name
+            )
+        else:
+            await redis_client.execute_command(
+                "FT.ALIASUPDATE", CHUNK_INDEX_NAME, index_name
+            )
+            try:
+                await redis_client.execute_command("FT.DROPINDEX", current)
+            except ResponseError as e:
+                logger.warning(f"Failed to drop Redis Search index '{current}': {e}")
+    except ResponseError as e:
+        # another worker may have finished the same swap first
+        if not await _alias_points_to(index_name):
+            logger.error(
+                f"Failed to move Redis Search alias '{CHUNK_INDEX_NAME}' to "
+                f"'{index_name}': {e}"
+            )
+            return
+
+    logger.info(
+        f"Redis Search alias '{CHUNK_INDEX_NAME}' now points to '{index_name}'."
+    )
+
+
+async def _alias_points_to(index_name: str) -> bool:
+    info = await _get_index_info(CHUNK_INDEX_NAME)
+    return bool(info) and info["index_name"].decode("utf-8") == index_name
+
+
+async def _drop_legacy_doc_index(logger):
+    # the doc: hashes still hold whole-file vectors for reuse, so keep them
+    try:
+        await redis_client.execute_command("FT.DROPINDEX", INDEX_NAME)
+        logger.info(f"Legacy Redis Search index '{INDEX_NAME}' dropped.")
+    except ResponseError as e:
+        if "Unknown" not in str(e) and "no such index" not in str(e):
+            logger.warning(f"Failed to drop Redis Search index '{INDEX_NAME}': {e}")
+
+
+def _log_swap_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger = logging.getLogger("uvicorn")
+        logger.error(
+            f"Redis Search index migration failed: {task.exception()}",
+            exc_info=task.exception(),
+        )
+
+
 async def init_redis_index(env: str):
-    global redis_client
+    global redis_client, index_swap_task
 
     logger = logging.getLogger("uvicorn")
+    if VECTOR_ALGORITHM not in VECTOR_ALGORITHMS:
+        logger.error(
+            f"Unsupported VECTOR_ALGORITHM '{VECTOR_ALGORITHM}'; "
+            f"expected one of {', '.join(VECTOR_ALGORITHMS)}."
+        )
+        exit(1)
+
     # await drop_redis_index(logger)
+    schema = _chunk_index_schema(env)
+    index_name = f"{CHUNK_INDEX_NAME}_{_chunk_index_version(schema)}"
     command_args = [
         "FT.CREATE",
-        INDEX_NAME,
+        index_name,
         "ON",
         "HASH",
         "PREFIX",
         "1",
-        DOC_PREFIX,
-        "SCHEMA",
-        "filename",
-        "TAG",
-        "embedding" + "_" + env,
-        "VECTOR",
-        "HNSW",
-        "6",
-        "TYPE",
-        "FLOAT32",
-        "DIM",
-        EMB_DIM,
-        "DISTANCE_METRIC",
-        "L2",
+        CHUNK_PREFIX,
+        *schema,
     ]
 
     try:
@@ -62,13 +188,40 @@ async def init_redis_index(env: str):
             raise Exception
 
         await redis_client.execute_command(*command_args)
-        logger.info(f"Redis Search index '{INDEX_NAME}' created successfully.")
+        logger.info(f"Redis Search index '{index_name}' created successfully.")
     except ResponseError as e:
         if "Index already exists" in str(e):
-            logger.info(f"Redis Search index '{INDEX_NAME}' already exists.")
+            logger.info(f"Redis Search index '{index_name}' already exists.")
         else:
             logger.error(f"Failed to create Redis Search index: {e}")
             raise
+    await _drop_legacy_doc_index(logger)
+
+    alias_info = await _get_index_info(CHUNK_INDEX_NAME)
+    current = alias_info["index_name"].decode("utf-8") if alias_info else None
+    if current == index_name:
+        return
+
+    if current is None:
+        try:
+            await redis_client.execute_command(
+                "FT.ALIASADD", CHUNK_INDEX_NAME, index_name
+            )
+        except ResponseError as e:
+            if not await _alias_points_to(index_name):
+                logger.error(f"Failed to add Redis Search alias: {e}")
+                raise
+        logger.info(f"Redis Search alias '{CHUNK_INDEX_NAME}' -> '{index_name}'.")
+        return
+
+    logger.info(
+        f"Migrating Redis Search alias '{CHUNK_INDEX_NAME}' from '{current}' "
+        f"to '{index_name}' in the background."
+    )
+    index_swap_task = asyncio.create_task(
+        _swap_chunk_index(logger, index_name, current)
+    )
+    index_swap_task.add_done_callback(_log_swap_failure)
 
 
 async def init_redis(env: SimpleNamespace):
@@ -99,6 +252,9 @@ async def init_redis(env: SimpleNamespace):
 async def shutdown_redis():
     global redis_client
 
+    if index_swap_task and not index_swap_task.done():
+        index_swap_task.cancel()
+
     if redis_client:
         await redis_client.close()
         await redis_client.connection_pool.disconnect()
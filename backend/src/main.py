@@ -8,10 +8,11 @@ from types import SimpleNamespace
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
 
 from .api import routes
 from .client import (
+    get_fs,
+    get_redis_client,
     init_db,
     init_redis,
     init_redis_index,
@@ -20,9 +21,11 @@ from .client import (
     shutdown_redis,
 )
 from .middleware import load_middlewares
-from .rag import init_torch
-from .utils.constants import REQUIRED_APP_VARS
-from .utils.populate_db import populate_db
+from .middleware.compression import SelectiveGZipMiddleware
+from .rag import encoder, init_torch
+from .rag.queue import ingest_queue
+from .utils.constants import GZIP_EXCLUDED_PATHS, REQUIRED_APP_VARS
+from .utils.populate_db import migrate_folder_tree, populate_db
 
 logger = logging.getLogger("uvicorn")
 
@@ -62,11 +65,19 @@ async def lifespan(app: FastAPI):
     await init_search_index(app_vars)
     logger.info("Atlas Search index initialized successfully.")
 
+    await migrate_folder_tree()
+    logger.info("Folder tree migrations finished.")
+
     init_torch()
+    if encoder.pinned:
+        create_task(encoder.warm_up())
+    await ingest_queue.start(get_redis_client(), get_fs())
+    logger.info("Ingest queue workers started.")
     create_task(populate_db(app_vars))
 
     yield
 
+    await ingest_queue.stop()
     await shutdown_db()
     await shutdown_redis()
     logger.info("Application shutting down.")
@@ -84,6 +95,8 @@ app.add_middleware(
 )
 
 app.include_router(routes)
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.add_middleware(
+    SelectiveGZipMiddleware, minimum_size=1000, exclude_paths=GZIP_EXCLUDED_PATHS
+)
 for middleware in load_middlewares():
     app.middleware("http")(middleware)
@@ -0,0 +1,17 @@
+import re
+
+from starlette.middleware.gzip import GZipMiddleware
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    def __init__(self, app, exclude_paths=(), **kwargs):
+        super().__init__(app, **kwargs)
+        self.exclude_paths = [re.compile(pattern) for pattern in exclude_paths]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and any(
+            pattern.match(scope["path"]) for pattern in self.exclude_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -1,5 +1,6 @@
 from .baseDocument import BaseDocument
-from .file import File
-from .folder import Folder
+from .file import File, FileSummary
+from .folder import Folder, FolderSummary
+from .resolver import RefResolver, ref_id
 from .token import JWTToken
 from .user import User
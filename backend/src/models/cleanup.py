@@ -0,0 +1,71 @@
+import logging
+
+from .resolver import ref_id
+
+DELETE_BATCH_SIZE = 500
+FILE_CLEANUP_PROJECTION = {"owner": 1, "gridfs_id": 1, "content_hash": 1}
+
+
+async def release_file_data(files: list[dict]):
+    from redis.exceptions import RedisError
+
+    from src.client import get_db, get_redis_client
+    from src.rag import local_store
+    from src.rag.ingest import (
+        delete_document_vectors,
+        get_document_owners,
+        set_document_owners,
+    )
+    from src.utils.blobs import release_blobs
+
+    for file in files:
+        local_store.remove(str(ref_id(file["owner"])), str(file["_id"]))
+
+    await release_blobs(
+        get_db(), [file["gridfs_id"] for file in files if file["gridfs_id"]]
+    )
+
+    content_hashes = {file["content_hash"] for file in files if file["content_hash"]}
+    if not content_hashes:
+        return
+
+    owners = await get_document_owners(content_hashes, [file["_id"] for file in files])
+    r_client = get_redis_client()
+    try:
+        await delete_document_vectors(
+            r_client, [hash for hash in content_hashes if hash not in owners]
+        )
+        await set_document_owners(r_client, owners)
+    except RedisError as e:
+        logger = logging.getLogger("uvicorn")
+        logger.warning(f"Failed to clean up vectors for deleted files: {e}")
+
+
+async def delete_files(query: dict, label: str) -> int:
+    from .file import File
+
+    logger = logging.getLogger("uvicorn")
+    collection = File.get_pymongo_collection()
+    total = await collection.count_documents(query)
+
+    deleted = 0
+    while deleted < total:
+        files = (
+            await collection.find(query, FILE_CLEANUP_PROJECTION)
+            .limit(DELETE_BATCH_SIZE)
+            .to_list()
+        )
+        if not files:
+            break
+
+        for file in files:
+            file.setdefault("gridfs_id", None)
+            file.setdefault("content_hash", None)
+        await release_file_data(files)
+        await collection.delete_many({"_id": {"$in": [file["_id"] for file in files]}})
+
+        deleted += len(files)
+        if total > DELETE_BATCH_SIZE:
+            logger.info(f"Deleting {label}: {deleted}/{total} file(s) removed.")
+
+    return deleted
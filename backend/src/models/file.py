@@ -1,14 +1,42 @@
-from typing import List, Optional
+from typing import Any, List, Optional
 
-from beanie import Delete, Link, before_event
-from bson import ObjectId
-from pydantic import Field
+import numpy as np
+from beanie import Delete, Insert, Link, PydanticObjectId, after_event, before_event
+from bson import Binary
+from bson.binary import BinaryVectorDtype
+from pydantic import BaseModel, Field, field_validator
 
 from .baseDocument import BaseDocument
 from .folder import Folder
 from .user import User
 
 
+def pack_embedding(vector) -> Binary:
+    return Binary.from_vector(
+        np.asarray(vector, dtype=np.float32).tolist(), BinaryVectorDtype.FLOAT32
+    )
+
+
+def unpack_embedding(value) -> Optional[np.ndarray]:
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return np.asarray(value, dtype=np.float32)
+    # float32 vector binaries carry a dtype byte and a padding byte
+    return np.frombuffer(value, dtype=np.float32, offset=2)
+
+
+def _file_dict(file) -> dict:
+    return {
+        "id": str(file.id),
+        "file_name": file.file_name,
+        "file_type": file.file_type,
+        "file_size": file.file_size,
+        "tags": file.tags,
+        "gridfs_id": str(file.gridfs_id),
+    }
+
+
 class File(BaseDocument):
     file_name: str
     file_type: Optional[str] = None
@@ -17,44 +45,77 @@ class File(BaseDocument):
     folder: Optional[Link[Folder]] = None
     tags: List[str] = []
     gridfs_id: Optional[str] = Field(default=None)
-    embedding: Optional[List[float]] = Field(default=None)
+    embedding: Optional[bytes] = Field(default=None)
     content_hash: Optional[str] = Field(default=None)
 
     class Settings(BaseDocument.Settings):
         indexes = ["content_hash"]
 
+    @field_validator("embedding", mode="before")
+    @classmethod
+    def _pack_legacy_embedding(cls, v):
+        if isinstance(v, list):
+            return pack_embedding(v)
+        return v
+
+    @after_event(Insert)
+    async def _grow_folder_size(self):
+        await Folder.adjust_size(self.folder, self.file_size or 0)
+
+    @after_event(Delete)
+    async def _shrink_folder_size(self):
+        await Folder.adjust_size(self.folder, -(self.file_size or 0))
+
     @before_event(Delete)
     async def _delete_related_data(self):
-        from src.client import get_fs, get_redis_client
+        from .cleanup import release_file_data
 
-        fs = get_fs()
-        if self.gridfs_id:
-            await fs.delete(ObjectId(self.gridfs_id))
+        await release_file_data(
+            [
+                {
+                    "_id": self.id,
+                    "owner": self.owner,
+                    "gridfs_id": self.gridfs_id,
+                    "content_hash": self.content_hash,
+                }
+            ]
+        )
 
-        if self.content_hash:
-            other_files_with_same_hash = await File.find(
-                File.content_hash == self.content_hash, File.id != self.id
-            ).count()
+    async def _to_dict(self, include_refs=False):
+        from .resolver import RefResolver
 
-            if other_files_with_same_hash == 0:
-                r = get_redis_client()
-                redis_key = f"doc:{self.content_hash}"
-                if await r.exists(redis_key):
-                    await r.delete(redis_key)
+        refs = RefResolver()
+        if include_refs:
+            await refs.load_for_files([self])
+        return refs.file_dict(self, include_refs=include_refs)
 
-    async def _to_dict(self, include_refs=False):
-        file = {
-            "id": str(self.id),
-            "file_name": self.file_name,
-            "file_type": self.file_type,
-            "file_size": self.file_size,
-            "tags": self.tags,
-            "gridfs_id": str(self.gridfs_id),
+
+class FileSummary(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    file_name: str
+    file_type: Optional[str] = None
+    file_size: Optional[int] = None
+    tags: List[str] = []
+    gridfs_id: Optional[str] = None
+    folder: Optional[Any] = None
+    content_hash: Optional[str] = None
+
+    class Settings:
+        projection = {
+            "_id": 1,
+            "file_name": 1,
+            "file_type": 1,
+            "file_size": 1,
+            "tags": 1,
+            "gridfs_id": 1,
+            "folder": 1,
+            "content_hash": 1,
         }
 
-        if include_refs and self.folder:
-            folder = await self.folder.fetch()
-            if folder:
-                file["folder"] = await folder._to_dict()
+    async def _to_dict(self, include_refs=False):
+        from .resolver import RefResolver
 
-        return file
+        refs = RefResolver()
+        if include_refs:
+            await refs.load_for_files([self])
+        return refs.file_dict(self, include_refs=include_refs)
@@ -1,7 +1,9 @@
-from typing import List, Optional
+from typing import Any, List, Optional
 
-from beanie import Delete, Link, before_event
+from beanie import Delete, Insert, Link, PydanticObjectId, after_event, before_event
+from beanie.operators import In, Inc
 from bson.dbref import DBRef
+from pydantic import BaseModel, Field
 
 from src.utils.constants import META_DATA_SIZE
 
@@ -9,77 +11,188 @@ from .baseDocument import BaseDocument
 from .user import User
 
 
+def _folder_dict(folder) -> dict:
+    return {
+        "id": str(folder.id),
+        "name": folder.name,
+        "folder_size": folder.folder_size,
+    }
+
+
 class Folder(BaseDocument):
     name: str
     owner: Link[User]
     parent: Optional[Link["Folder"]] = None
     shared_with: List[Link[User]] = []
     folder_size: int = META_DATA_SIZE
+    ancestors: List[PydanticObjectId] = []
 
-    async def calculate_total_size(self):
-        from .file import File
+    class Settings(BaseDocument.Settings):
+        indexes = ["ancestors"]
 
-        total_size = self.folder_size
-        file_size = await File.find(File.folder == DBRef(Folder.__name__, self.id)).sum(
-            File.file_size
+    @staticmethod
+    def subtree_query(folder_id) -> dict:
+        return {"$or": [{"_id": folder_id}, {"ancestors": folder_id}]}
+
+    async def subtree(self) -> List["FolderSummary"]:
+        return (
+            await Folder.find(Folder.subtree_query(self.id))
+            .project(FolderSummary)
+            .to_list()
         )
-        total_size = total_size + file_size if file_size else total_size
-        child_folders = await Folder.find(
-            Folder.parent == DBRef(Folder.__name__, self.id)
-        ).to_list()
-        for child in child_folders:
-            total_size += await child.calculate_total_size()
 
-        return total_size
+    async def subtree_paths(self) -> dict:
+        folders = await self.subtree()
+        names = {folder.id: folder.name for folder in folders}
+
+        paths = {}
+        for folder in folders:
+            parts = []
+            if folder.id != self.id:
+                start = folder.ancestors.index(self.id)
+                parts = [names[id] for id in folder.ancestors[start:] if id in names]
+            paths[folder.id] = "/".join([*parts, folder.name]) + "/"
+
+        return paths
+
+    @before_event(Insert)
+    async def _set_ancestors(self):
+        if self.parent is None:
+            self.ancestors = []
+            return
+
+        parent = self.parent
+        if isinstance(parent, Link):
+            parent = await parent.fetch()
+        self.ancestors = [*parent.ancestors, parent.id]
+
+    @after_event(Insert)
+    async def _grow_ancestors(self):
+        await Folder.inc_size(self.ancestors, self.folder_size)
+
+    @staticmethod
+    async def inc_size(folder_ids, delta: int):
+        if folder_ids and delta:
+            await Folder.find(In(Folder.id, list(folder_ids))).update(
+                Inc({Folder.folder_size: delta})
+            )
+
+    @staticmethod
+    async def add_sizes(sizes: list[tuple["Folder", int]]):
+        from pymongo import UpdateOne
+
+        deltas = {}
+        for folder, size in sizes:
+            for folder_id in [*folder.ancestors, folder.id]:
+                deltas[folder_id] = deltas.get(folder_id, 0) + size
+
+        updates = [
+            UpdateOne({"_id": folder_id}, {"$inc": {"folder_size": delta}})
+            for folder_id, delta in deltas.items()
+            if delta
+        ]
+        if updates:
+            await Folder.get_pymongo_collection().bulk_write(updates, ordered=False)
+
+    @staticmethod
+    async def adjust_size(folder, delta: int):
+        if folder is None or not delta:
+            return
+
+        if isinstance(folder, Link):
+            folder = await Folder.find_one(Folder.id == folder.ref.id).project(
+                FolderSummary
+            )
+            if folder is None:
+                return
+        await Folder.inc_size([*folder.ancestors, folder.id], delta)
+
+    async def calculate_total_size(self):
+        return self.folder_size
 
     @before_event(Delete)
     async def _cascade_delete(self):
-        from .file import (
-            File,  # cascade delete can only be triggered with a get request??
+        from .cleanup import (
+            delete_files,  # cascade delete can only be triggered with a get request??
         )
 
-        files = await File.find(
-            File.folder == DBRef(Folder.__name__, self.id)
-        ).to_list()
-        for file in files:
-            await file.delete()
+        folder_ids = [folder.id for folder in await self.subtree()]
+        await delete_files(
+            {"folder.$id": {"$in": folder_ids}}, f"folder {self.name} ({self.id})"
+        )
 
-        subfolders = await Folder.find(
-            Folder.parent == DBRef(Folder.__name__, self.id)
-        ).to_list()
-        for folder in subfolders:
-            await folder.delete()
+        await Folder.find(Folder.ancestors == self.id).delete_many()
+        await Folder.inc_size(self.ancestors, -self.folder_size)
 
     async def _to_dict(
         self, include_refs=False, include_parents=False, include_children=False
     ):
-        folder = {
-            "id": str(self.id),
-            "name": self.name,
-            "folder_size": self.folder_size,
-        }
+        folder = _folder_dict(self)
 
         if include_refs:
-            from .file import File
+            from .file import File, FileSummary
 
-            files = await File.find(
-                File.folder == DBRef(Folder.__name__, self.id)
-            ).to_list()
-            folder["files"] = []
-            for file in files:
-                folder["files"].append(await file._to_dict())
+            files = (
+                await File.find(File.folder == DBRef(Folder.__name__, self.id))
+                .project(FileSummary)
+                .to_list()
+            )
+            folder["files"] = [await file._to_dict() for file in files]
 
-            sub_folders = await Folder.find(
+            sub_folders_query = Folder.find(
                 Folder.parent == DBRef(Folder.__name__, self.id)
-            ).to_list()
-            folder["sub_folders"] = []
-            for sub_folder in sub_folders:
-                folder["sub_folders"] = await sub_folder._to_dict(
-                    include_refs=include_children, include_children=include_children
-                )
+            )
+            if include_children:
+                sub_folders = await sub_folders_query.to_list()
+                folder["sub_folders"] = [
+                    await sub_folder._to_dict(include_refs=True, include_children=True)
+                    for sub_folder in sub_folders
+                ]
+            else:
+                sub_folders = await sub_folders_query.project(FolderSummary).to_list()
+                folder["sub_folders"] = [
+                    await sub_folder._to_dict(parent=_folder_dict(self))
+                    for sub_folder in sub_folders
+                ]
 
         if self.parent:
-            parent = await self.parent.fetch()
-            folder["parent"] = await parent._to_dict(include_parents=include_parents)
+            from .resolver import RefResolver, ref_id
+
+            refs = RefResolver()
+            await refs.load_folders([*self.ancestors, ref_id(self.parent)])
+            parent = refs.folder_dict(ref_id(self.parent))
+            if parent is not None:
+                folder["parent"] = parent
+
+        return folder
+
+
+class FolderSummary(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    name: str
+    folder_size: int = META_DATA_SIZE
+    parent: Optional[Any] = None
+    ancestors: List[PydanticObjectId] = []
+
+    class Settings:
+        projection = {
+            "_id": 1,
+            "name": 1,
+            "folder_size": 1,
+            "parent": 1,
+            "ancestors": 1,
+        }
+
+    async def _to_dict(self, parent: Optional[dict] = None):
+        folder = _folder_dict(self)
+
+        if parent is None and self.parent:
+            from .resolver import RefResolver
+
+            refs = RefResolver()
+            await refs.load_for_folders([self])
+            parent = refs.folder_dict(self.parent.id)
+        if parent is not None:
+            folder["parent"] = parent
 
         return folder
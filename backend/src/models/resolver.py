@@ -0,0 +1,79 @@
+from beanie import Link
+from beanie.operators import In
+
+
+def ref_id(value):
+    if value is None:
+        return None
+    if isinstance(value, Link):
+        return value.ref.id
+    return value.id
+
+
+class RefResolver:
+    def __init__(self):
+        self.folders = {}
+        self.folder_dicts = {}
+
+    def add_folders(self, folders):
+        for folder in folders:
+            self.folders.setdefault(folder.id, folder)
+
+    async def load_folders(self, folder_ids):
+        from .folder import Folder, FolderSummary
+
+        pending = {id for id in folder_ids if id is not None} - self.folders.keys()
+        while pending:
+            folders = (
+                await Folder.find(In(Folder.id, list(pending)))
+                .project(FolderSummary)
+                .to_list()
+            )
+            self.add_folders(folders)
+            pending = set()
+            for folder in folders:
+                pending.update(folder.ancestors)
+                if folder.parent:
+                    pending.add(ref_id(folder.parent))
+            pending -= self.folders.keys()
+
+    async def load_for_files(self, files):
+        await self.load_folders([ref_id(file.folder) for file in files])
+
+    async def load_for_folders(self, folders):
+        self.add_folders(folders)
+        await self.load_folders(
+            [
+                id
+                for folder in folders
+                for id in [*folder.ancestors, ref_id(folder.parent)]
+            ]
+        )
+
+    def folder_dict(self, folder_id):
+        if folder_id in self.folder_dicts:
+            return self.folder_dicts[folder_id]
+
+        folder = self.folders.get(folder_id)
+        if folder is None:
+            return None
+
+        from .folder import _folder_dict
+
+        result = _folder_dict(folder)
+        parent = self.folder_dict(ref_id(folder.parent))
+        if parent is not None:
+            result["parent"] = parent
+
+        self.folder_dicts[folder_id] = result
+        return result
+
+    def file_dict(self, file, include_refs=True):
+        from .file import _file_dict
+
+        result = _file_dict(file)
+        if include_refs:
+            folder = self.folder_dict(ref_id(file.folder))
+            if folder is not None:
+                result["folder"] = folder
+        return result
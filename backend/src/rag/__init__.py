@@ -1,17 +1,72 @@
 import asyncio
 import gc
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv, path
+from time import monotonic, perf_counter
 
 import numpy as np
 import psutil
 from sentence_transformers import SentenceTransformer
 
+from .cache import EmbeddingCache
+from .local_store import LocalVectorStore
+from .scheduler import EmbeddingScheduler
+
 EMB_DIM = 384
 CHUNK_WORDS = 200
 SAMPLE_CHUNKS = 5
+CHUNK_OVERLAP = int(getenv("CHUNK_OVERLAP", "40"))
+INGEST_BATCH_CHUNKS = int(getenv("INGEST_BATCH_CHUNKS", "16"))
 TOP_K = 5
 DOC_PREFIX = "doc:"
+CHUNK_PREFIX = "chunk:"
 INDEX_NAME = "doc_index_" + getenv("ENV", "prod")
+CHUNK_INDEX_NAME = "chunk_index_" + getenv("ENV", "prod")
+CHUNK_BACKFILL_KEY = "backfill:chunk_vectors:" + getenv("ENV", "prod")
+VECTOR_ALGORITHM = getenv("VECTOR_ALGORITHM", "HNSW").upper()
+VECTOR_ALGORITHMS = ("HNSW", "FLAT")
+HNSW_M = int(getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_RUNTIME = int(getenv("HNSW_EF_RUNTIME", "64"))
+VECTOR_INITIAL_CAP = int(getenv("VECTOR_INITIAL_CAP", "0"))
+FLAT_BLOCK_SIZE = int(getenv("FLAT_BLOCK_SIZE", "0"))
+INDEX_MIGRATION_TIMEOUT = int(getenv("INDEX_MIGRATION_TIMEOUT", "3600"))
+SEARCH_FALLBACK = getenv("SEARCH_FALLBACK", "local").lower()
+LOCAL_STORE_MAX_OWNERS = int(getenv("LOCAL_STORE_MAX_OWNERS", "32"))
+INGEST_QUEUE_PREFIX = "ingest:" + getenv("ENV", "prod") + ":"
+INGEST_WORKERS = int(getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_ATTEMPTS = int(getenv("INGEST_MAX_ATTEMPTS", "5"))
+INGEST_RETRY_BASE_SECONDS = float(getenv("INGEST_RETRY_BASE_SECONDS", "5"))
+INGEST_RETRY_MAX_SECONDS = float(getenv("INGEST_RETRY_MAX_SECONDS", "600"))
+INGEST_CLAIM_IDLE_MS = int(getenv("INGEST_CLAIM_IDLE_MS", "300000"))
+INGEST_POLL_MS = int(getenv("INGEST_POLL_MS", "500"))
+INGEST_STATUS_TTL = int(getenv("INGEST_STATUS_TTL", "604800"))
+INGEST_SWEEP_SECONDS = int(getenv("INGEST_SWEEP_SECONDS", "300"))
+INGEST_SHUTDOWN_GRACE = float(getenv("INGEST_SHUTDOWN_GRACE", "30"))
+CHUNK_CANDIDATES = int(getenv("CHUNK_CANDIDATES", "50"))
+CHUNK_AGGREGATION = getenv("CHUNK_AGGREGATION", "max").lower()
+CHUNK_AGGREGATION_TOP = int(getenv("CHUNK_AGGREGATION_TOP", "3"))
+EMBED_MAX_BATCH = int(getenv("EMBED_MAX_BATCH", "16"))
+EMBED_MAX_BATCH_MB = int(getenv("EMBED_MAX_BATCH_MB", "64"))
+EMBED_BATCH_WINDOW_MS = float(getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_SCHEDULER_MAX_BATCH = int(getenv("EMBED_SCHEDULER_MAX_BATCH", "32"))
+EMBED_CACHE_SIZE = int(getenv("EMBED_CACHE_SIZE", "1024"))
+EMBED_CACHE_TTL = int(getenv("EMBED_CACHE_TTL", "86400"))
+EMBED_CACHE_REDIS = getenv("EMBED_CACHE_REDIS", "1") == "1"
+QUERY_CACHE_PREFIX = "qemb:"
+EMBED_MEMORY_BUDGET_MB = int(getenv("EMBED_MEMORY_BUDGET_MB", "700"))
+EMBED_MODEL_PINNED = getenv("EMBED_MODEL_PINNED", "0") == "1"
+EMBED_UNLOAD_MIN_DELAY = int(getenv("EMBED_UNLOAD_MIN_DELAY", "30"))
+EMBED_UNLOAD_MAX_DELAY = int(getenv("EMBED_UNLOAD_MAX_DELAY", "900"))
+# keep the model resident for this many average request gaps
+EMBED_UNLOAD_GAP_FACTOR = 4
+EMBEDDING_BACKEND = getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+ONNX_INT8_FILE = "onnx/model_qint8_avx2.onnx"
+# rough activation footprint of one padded token across the encoder layers
+ACTIVATION_BYTES_PER_TOKEN = EMB_DIM * 4 * 32
 
 
 def init_torch():
@@ -22,16 +77,52 @@ def init_torch():
     torch.set_num_interop_threads(1)
 
 
+def load_sentence_transformer(source, backend="torch", **kwargs):
+    if backend in ("onnx", "onnx-int8"):
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if backend == "onnx-int8":
+            model_kwargs["file_name"] = ONNX_INT8_FILE
+        return SentenceTransformer(
+            source, backend="onnx", model_kwargs=model_kwargs, **kwargs
+        )
+
+    model = SentenceTransformer(source, **kwargs)
+    if backend == "torch-int8":
+        import torch
+
+        torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+    return model
+
+
 class LifecycleEncoder:
-    def __init__(self, model_name=None):
+    def __init__(self, model_name=None, backend=EMBEDDING_BACKEND):
         self.model_name = model_name
         self.model = None
+        self.backend = backend if backend in EMBEDDING_BACKENDS else "torch"
         self.active_queries = 0
         self.lock = asyncio.Lock()
         self.encoding_semaphore = asyncio.Semaphore(2)
-        self.memory_threshold_mb = 400
+        self.memory_budget_mb = EMBED_MEMORY_BUDGET_MB
+        self.pinned = EMBED_MODEL_PINNED
         self.last_used = None
-        self.unload_delay = 30
+        self.mean_gap = None
+        self.min_unload_delay = EMBED_UNLOAD_MIN_DELAY
+        self.max_unload_delay = EMBED_UNLOAD_MAX_DELAY
+        self.unload_task = None
+        self.max_batch_size = EMBED_MAX_BATCH
+        self.max_batch_bytes = EMBED_MAX_BATCH_MB * 1024 * 1024
+        # torch releases the GIL during inference, so a single worker thread
+        # keeps the event loop free without duplicating the model in memory
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+
+        self.load_count = 0
+        self.unload_count = 0
+        self.load_seconds = 0.0
+        self.last_load_seconds = 0.0
+        self.cold_seconds = 0.0
+        self.cold_since = monotonic()
 
     def _check_memory_usage(self):
         memory_mb = psutil.Process().memory_info().rss / 1024 / 1024
@@ -39,6 +130,7 @@ class LifecycleEncoder:
 
     def load_model(self, local_files_only=True):
         if self.model is None:
+            started = perf_counter()
             memory_mb = self._check_memory_usage()
             if memory_mb > 490:
                 gc.collect()
@@ -48,71 +140,215 @@ class LifecycleEncoder:
             model_path = path.join(backend_dir, self.model_name)
 
             if path.exists(model_path):
-                self.model = SentenceTransformer(model_path)
+                source, kwargs = model_path, {}
             else:
-                self.model = SentenceTransformer(
-                    self.model_name, local_files_only=local_files_only
+                source, kwargs = self.model_name, {"local_files_only": local_files_only}
+
+            try:
+                self.model = load_sentence_transformer(source, self.backend, **kwargs)
+            except Exception as e:
+                if self.backend == "torch":
+                    raise
+
+                from src import logger
+
+                logger.warning(
+                    f"Embedding backend '{self.backend}' unavailable ({e}), "
+                    "falling back to torch."
                 )
+                self.backend = "torch"
+                self.model = load_sentence_transformer(source, **kwargs)
 
             self.model.eval()
+            self.load_count += 1
+            self.last_load_seconds = perf_counter() - started
+            self.load_seconds += self.last_load_seconds
+            self.cold_seconds += monotonic() - self.cold_since
+            self.cold_since = None
+
+    def _estimate_tokens(self, text):
+        max_seq_length = getattr(self.model, "max_seq_length", None) or 128
+        return min(max_seq_length, int(len(text.split()) * 1.4) + 2)
+
+    def _plan_batches(self, texts):
+        batches = []
+        batch = []
+        longest = 0
+        for text in texts:
+            tokens = max(longest, self._estimate_tokens(text))
+            batch_bytes = (len(batch) + 1) * tokens * ACTIVATION_BYTES_PER_TOKEN
+            if batch and (
+                len(batch) >= self.max_batch_size or batch_bytes > self.max_batch_bytes
+            ):
+                batches.append(batch)
+                batch = []
+                tokens = self._estimate_tokens(text)
+            batch.append(text)
+            longest = tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _encode_batches(self, texts):
+        all_embeddings = []
+        for batch in self._plan_batches(texts):
+            emb = self.model.encode(
+                batch,
+                batch_size=len(batch),
+                convert_to_tensor=False,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+            all_embeddings.append(np.asarray(emb, dtype=np.float32))
+            del emb
+
+        return np.concatenate(all_embeddings, axis=0)
+
+    async def _run_in_executor(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
 
     def unload_model(self):
         if self.model is not None:
             del self.model
             self.model = None
+            self.unload_count += 1
+            self.cold_since = monotonic()
         gc.collect()
 
-    async def _schedule_unload(self):
-        await asyncio.sleep(self.unload_delay)
+    def _unload_delay(self):
+        if self.mean_gap is None:
+            return self.min_unload_delay
+        return min(
+            self.max_unload_delay,
+            max(self.min_unload_delay, self.mean_gap * EMBED_UNLOAD_GAP_FACTOR),
+        )
+
+    def _record_use(self):
+        now = monotonic()
+        if self.last_used is not None:
+            gap = now - self.last_used
+            if self.mean_gap is None:
+                self.mean_gap = gap
+            else:
+                self.mean_gap = 0.8 * self.mean_gap + 0.2 * gap
+        self.last_used = now
+
+    def _schedule_unload(self):
+        if self.pinned or self.model is None:
+            return
+        if self.unload_task and not self.unload_task.done():
+            return
+        self.unload_task = asyncio.create_task(self._unload_when_idle())
+
+    async def _unload_when_idle(self):
+        while True:
+            delay = self._unload_delay()
+            if self._check_memory_usage() > self.memory_budget_mb:
+                delay = self.min_unload_delay
+
+            remaining = self.last_used + delay - monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+                continue
+
+            async with self.lock:
+                if self.active_queries == 0 and self.model is not None:
+                    await self._run_in_executor(self.unload_model)
+            return
+
+    async def warm_up(self):
         async with self.lock:
-            if self.active_queries == 0:
-                self.unload_model()
+            if self.model is None:
+                await self._run_in_executor(self.load_model)
 
     async def encode(self, texts):
         async with self.encoding_semaphore:
-            memory_mb = self._check_memory_usage()
-            if memory_mb > self.memory_threshold_mb:
-                async with self.lock:
-                    self.unload_model()
-                gc.collect()
-                await asyncio.sleep(0.1)
-
             async with self.lock:
                 self.active_queries += 1
                 if self.model is None:
-                    self.load_model()
-                self.last_used = asyncio.get_event_loop().time()
+                    await self._run_in_executor(self.load_model)
+                self._record_use()
 
             try:
                 if isinstance(texts, str):
                     texts = [texts]
 
-                all_embeddings = []
-                for text in texts:
-                    emb = self.model.encode(
-                        [text],
-                        batch_size=1,
-                        convert_to_tensor=False,
-                        normalize_embeddings=True,
-                        show_progress_bar=False,
-                    )
-                    all_embeddings.append(emb[0])
-                    del emb
+                if not texts:
+                    return np.empty((0, EMB_DIM), dtype=np.float32)
 
-                return np.array(all_embeddings, dtype=np.float32)
+                return await self._run_in_executor(self._encode_batches, texts)
 
             finally:
                 async with self.lock:
                     self.active_queries -= 1
+                    self.last_used = monotonic()
                     if self.active_queries == 0:
-                        asyncio.create_task(self._schedule_unload())
+                        self._schedule_unload()
+
+    def stats(self):
+        cold_seconds = self.cold_seconds
+        if self.cold_since is not None:
+            cold_seconds += monotonic() - self.cold_since
+
+        return {
+            "loaded": self.model is not None,
+            "backend": self.backend,
+            "pinned": self.pinned,
+            "active_queries": self.active_queries,
+            "load_count": self.load_count,
+            "unload_count": self.unload_count,
+            "load_seconds_total": self.load_seconds,
+            "last_load_seconds": self.last_load_seconds,
+            "cold_seconds_total": cold_seconds,
+            "mean_request_gap_seconds": self.mean_gap,
+            "unload_delay_seconds": self._unload_delay(),
+            "rss_mb": self._check_memory_usage(),
+            "memory_budget_mb": self.memory_budget_mb,
+        }
 
 
 encoder = LifecycleEncoder(getenv("EMBEDDING_MODEL_NAME"))
+scheduler = EmbeddingScheduler(
+    encoder.encode,
+    emb_dim=EMB_DIM,
+    window_ms=EMBED_BATCH_WINDOW_MS,
+    max_batch=EMBED_SCHEDULER_MAX_BATCH,
+)
+
+
+query_cache = EmbeddingCache(
+    f"{encoder.model_name}:{encoder.backend}",
+    emb_dim=EMB_DIM,
+    max_entries=EMBED_CACHE_SIZE,
+    ttl=EMBED_CACHE_TTL,
+    key_prefix=QUERY_CACHE_PREFIX,
+    use_redis=EMBED_CACHE_REDIS,
+)
+
+local_store = LocalVectorStore(EMB_DIM, max_owners=LOCAL_STORE_MAX_OWNERS)
 
 
 async def encode_query(texts):
-    return await encoder.encode(texts)
+    if isinstance(texts, str):
+        texts = [texts]
+    if not texts:
+        return np.empty((0, EMB_DIM), dtype=np.float32)
+
+    rows = await query_cache.get_many(texts)
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        embeddings = await scheduler.submit(missing_texts)
+        await query_cache.set_many(missing_texts, embeddings)
+        for i, row in zip(missing, embeddings):
+            rows[i] = row
+
+    return np.stack(rows).astype(np.float32, copy=False)
+
+
+async def encode_documents(texts):
+    return await scheduler.submit(texts)
 
 
 def sample_text_chunks(full_text, n=CHUNK_WORDS, sample_chunks=SAMPLE_CHUNKS):
@@ -126,3 +362,35 @@ def sample_text_chunks(full_text, n=CHUNK_WORDS, sample_chunks=SAMPLE_CHUNKS):
     else:
         sampled_chunks = chunks
     return sampled_chunks
+
+
+class TextChunker:
+    def __init__(self, n=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+        self.n = n
+        self.step = max(1, n - overlap)
+        self.window = deque()
+        self.offset = 0
+        self.fresh = 0
+
+    def feed(self, segment):
+        for match in re.finditer(r"\S+", segment):
+            self.window.append(match.group())
+            self.fresh += 1
+            if len(self.window) == self.n:
+                yield self.offset, " ".join(self.window)
+                for _ in range(self.step):
+                    self.window.popleft()
+                self.offset += self.step
+                self.fresh = 0
+
+    def finish(self):
+        if self.fresh:
+            self.fresh = 0
+            yield self.offset, " ".join(self.window)
+
+
+def iter_text_chunks(segments, n=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    chunker = TextChunker(n, overlap)
+    for segment in segments:
+        yield from chunker.feed(segment)
+    yield from chunker.finish()
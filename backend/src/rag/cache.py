@@ -0,0 +1,134 @@
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from time import monotonic
+
+import numpy as np
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        model_name: str,
+        emb_dim: int,
+        max_entries: int,
+        ttl: int,
+        key_prefix: str,
+        use_redis: bool = True,
+    ):
+        self.model_name = model_name or ""
+        self.emb_dim = emb_dim
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.use_redis = use_redis
+        self.entries = OrderedDict()
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(unicodedata.normalize("NFKC", text).split())
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha1(
+            f"{self.model_name}\0{self.normalize(text)}".encode("utf-8")
+        ).hexdigest()
+        return f"{self.key_prefix}{self.model_name}:{digest}"
+
+    def _get_local(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, row = entry
+        if expires_at < monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            return None
+
+        self.entries.move_to_end(key)
+        return row
+
+    def _set_local(self, key, row):
+        self.entries[key] = (monotonic() + self.ttl, row)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_many(self, texts):
+        keys = [self._key(text) for text in texts]
+        rows = [self._get_local(key) for key in keys]
+        self.local_hits += sum(row is not None for row in rows)
+
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing and self.use_redis:
+            from redis.exceptions import RedisError
+
+            from src.client import get_redis_client
+
+            r_client = get_redis_client()
+            try:
+                values = await r_client.mget([keys[i] for i in missing])
+            except (RedisError, AttributeError) as e:
+                from src import logger
+
+                logger.warning(f"Embedding cache lookup failed: {e}")
+                values = [None] * len(missing)
+
+            for i, value in zip(missing, values):
+                if value is None or len(value) != self.emb_dim * 4:
+                    continue
+                row = np.frombuffer(value, dtype=np.float32)
+                rows[i] = row
+                self._set_local(keys[i], row)
+                self.redis_hits += 1
+
+        self.misses += sum(row is None for row in rows)
+        return rows
+
+    async def set_many(self, texts, rows):
+        keys = [self._key(text) for text in texts]
+        rows = [np.asarray(row, dtype=np.float32) for row in rows]
+        for key, row in zip(keys, rows):
+            self._set_local(key, row)
+
+        if not (keys and self.use_redis):
+            return
+
+        from redis.exceptions import RedisError
+
+        from src.client import get_redis_client
+
+        r_client = get_redis_client()
+        try:
+            pipe = r_client.pipeline()
+            for key, row in zip(keys, rows):
+                pipe.setex(key, self.ttl, row.tobytes())
+            await pipe.execute()
+        except (RedisError, AttributeError) as e:
+            from src import logger
+
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def stats(self):
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "redis_enabled": self.use_redis,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (
+                (self.local_hits + self.redis_hits) / lookups if lookups else 0.0
+            ),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -1,31 +1,206 @@
 import asyncio
+import codecs
+import csv
 import hashlib
+import re
+from time import time
+from typing import Optional
 
 import numpy as np
+from beanie import PydanticObjectId
 from bson import ObjectId
+from pydantic import BaseModel, Field
 
 from src.middleware.limits import ENV
 from src.models import File
+from src.models.file import pack_embedding, unpack_embedding
+from src.utils.streaming import iter_gridfs_file
 
-from . import DOC_PREFIX, encode_query, sample_text_chunks
+from . import (
+    CHUNK_BACKFILL_KEY,
+    CHUNK_PREFIX,
+    DOC_PREFIX,
+    EMB_DIM,
+    INGEST_BATCH_CHUNKS,
+    TextChunker,
+    encode_documents,
+    local_store,
+)
 from .manager import get_ingest_semaphore
 
+MAX_WORD_CARRY = 64 * 1024
+TRAILING_WORD = re.compile(r"\S+\Z")
 
-def extract_text_from_contents(contents: bytes, mime_type: str) -> str:
+
+class FileHash(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    content_hash: str
+
+
+class FileEmbedding(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    embedding: Optional[bytes] = None
+
+
+async def _iter_decoded(blocks):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    carry = ""
+    async for block in blocks:
+        text = carry + decoder.decode(block)
+        # hold back a trailing partial word until the next block completes it
+        match = TRAILING_WORD.search(text)
+        split = match.start() if match else len(text)
+        if not split and len(text) > MAX_WORD_CARRY:
+            split = len(text)
+        if split:
+            yield text[:split]
+        carry = text[split:]
+    text = carry + decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def _iter_lines(blocks):
+    remainder = ""
+    async for text in _iter_decoded(blocks):
+        lines = (remainder + text).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+    if remainder:
+        yield remainder
+
+
+async def _iter_csv_records(blocks):
+    record = None
+    async for line in _iter_lines(blocks):
+        record = line if record is None else f"{record}\n{line}"
+        # a quoted field may span lines, so wait for its closing quote
+        if record.count('"') % 2 == 0:
+            yield record
+            record = None
+    if record is not None:
+        yield record
+
+
+async def iter_text_segments(grid_out, mime_type: str):
     if mime_type == "application/pdf":
         import fitz
 
+        contents = await grid_out.read()
         with fitz.open(stream=contents, filetype="pdf") as doc:
-            return " ".join(page.get_text() for page in doc).strip()
+            for page in doc:
+                yield page.get_text()
     elif mime_type == "text/plain":
-        return contents.decode("utf-8", errors="ignore").strip()
+        async for text in _iter_decoded(iter_gridfs_file(grid_out)):
+            yield text
     elif mime_type == "text/csv":
-        from io import StringIO
+        async for record in _iter_csv_records(iter_gridfs_file(grid_out)):
+            for row in csv.reader([record]):
+                yield " ".join(row)
+
+
+async def _iter_chunk_batches(segments, size):
+    chunker = TextChunker()
+    batch = []
+    async for segment in segments:
+        batch.extend(chunker.feed(segment))
+        while len(batch) >= size:
+            yield batch[:size]
+            batch = batch[size:]
+    batch.extend(chunker.finish())
+    if batch:
+        yield batch
+
+
+async def delete_document_vectors(r_client, content_hashes: list[str]):
+    if not content_hashes:
+        return
 
-        import pandas as pd
+    pipe = r_client.pipeline(transaction=False)
+    for content_hash in content_hashes:
+        pipe.hget(f"{DOC_PREFIX}{content_hash}", "chunks")
+    chunk_counts = await pipe.execute()
 
-        return pd.read_csv(StringIO(contents.decode("utf-8"))).to_string(index=False)
-    return ""
+    pipe = r_client.pipeline(transaction=False)
+    for content_hash, chunk_count in zip(content_hashes, chunk_counts):
+        keys = [f"{DOC_PREFIX}{content_hash}"]
+        if chunk_count:
+            keys.extend(
+                f"{CHUNK_PREFIX}{content_hash}:{i}" for i in range(int(chunk_count))
+            )
+        pipe.delete(*keys)
+    await pipe.execute()
+
+
+async def get_document_owners(content_hashes, exclude_ids=()) -> dict[str, set[str]]:
+    query = {"content_hash": {"$in": list(content_hashes)}}
+    if exclude_ids:
+        query["_id"] = {"$nin": list(exclude_ids)}
+
+    cursor = await File.get_pymongo_collection().aggregate(
+        [
+            {"$match": query},
+            {"$group": {"_id": "$content_hash", "owners": {"$addToSet": "$owner"}}},
+        ]
+    )
+    return {
+        doc["_id"]: {str(owner.id) for owner in doc["owners"]} async for doc in cursor
+    }
+
+
+async def set_document_owners(r_client, owners_by_hash: dict[str, set[str]]):
+    content_hashes = list(owners_by_hash)
+    if not content_hashes:
+        return
+
+    pipe = r_client.pipeline(transaction=False)
+    for content_hash in content_hashes:
+        pipe.hget(f"{DOC_PREFIX}{content_hash}", "chunks")
+    chunk_counts = await pipe.execute()
+
+    pipe = r_client.pipeline(transaction=False)
+    for content_hash, chunk_count in zip(content_hashes, chunk_counts):
+        if not chunk_count:
+            continue
+        owners_tag = ",".join(sorted(owners_by_hash[content_hash]))
+        pipe.hset(f"{DOC_PREFIX}{content_hash}", "owners", owners_tag)
+        for i in range(int(chunk_count)):
+            pipe.hset(f"{CHUNK_PREFIX}{content_hash}:{i}", "owners", owners_tag)
+    await pipe.execute()
+
+
+async def reuse_document_vectors(r_client, file_doc: File) -> bool:
+    content_hash = file_doc.content_hash
+    async with get_ingest_semaphore():
+        embedding, chunks = await r_client.hmget(
+            f"{DOC_PREFIX}{content_hash}", "embedding_" + ENV, "chunks"
+        )
+    if not chunks:
+        return False
+
+    if embedding and len(embedding) == EMB_DIM * 4:
+        emb = np.frombuffer(embedding, dtype=np.float32)
+    else:
+        twin = await File.find_one(
+            File.content_hash == content_hash,
+            File.embedding != None,
+            File.id != file_doc.id,
+        ).project(FileEmbedding)
+        if not twin:
+            return False
+        emb = unpack_embedding(twin.embedding)
+
+    owner_id = str(file_doc.owner.ref.id)
+    file_doc.embedding = pack_embedding(emb)
+    await file_doc.save()
+    local_store.upsert(owner_id, str(file_doc.id), emb)
+
+    owners = (await get_document_owners([content_hash])).get(content_hash, set())
+    owners.add(owner_id)
+    async with get_ingest_semaphore():
+        await set_document_owners(r_client, {content_hash: owners})
+    return True
 
 
 async def ingest_file_to_redis(r_client, fs, file_id: str):
@@ -37,40 +212,85 @@ async def ingest_file_to_redis(r_client, fs, file_id: str):
         return
 
     try:
-        gridfs_file = await fs.open_download_stream(ObjectId(file_doc.gridfs_id))
-        contents = await gridfs_file.read()
-
-        full_text = extract_text_from_contents(contents, file_doc.file_type)
-        if not full_text:
+        if file_doc.content_hash and await reuse_document_vectors(r_client, file_doc):
+            logger.info(f"Reused stored vectors for duplicate file {file_id}.")
             return
 
-        content_hash = hashlib.sha256(contents).hexdigest()
+        grid_out = await fs.open_download_stream(ObjectId(file_doc.gridfs_id))
+        content_hash = file_doc.content_hash
+        if not content_hash:
+            digest = hashlib.sha256()
+            async for block in iter_gridfs_file(grid_out):
+                digest.update(block)
+            content_hash = digest.hexdigest()
+            await grid_out.seek(0)
         file_doc.content_hash = content_hash
         redis_key = f"{DOC_PREFIX}{content_hash}"
+        owners = (await get_document_owners([content_hash])).get(content_hash, set())
+        owners.add(str(file_doc.owner.ref.id))
+        owners_tag = ",".join(sorted(owners))
+        async with get_ingest_semaphore():
+            store_chunks = not await r_client.hexists(redis_key, "chunks")
+
+        chunk_count = 0
+        emb_sum = np.zeros(EMB_DIM, dtype=np.float32)
+        segments = iter_text_segments(grid_out, file_doc.file_type)
+        async for batch in _iter_chunk_batches(segments, INGEST_BATCH_CHUNKS):
+            offsets = [offset for offset, _ in batch]
+            chunk_embeddings = await encode_documents([text for _, text in batch])
+            emb_sum += chunk_embeddings.sum(axis=0)
 
-        chunks = sample_text_chunks(full_text)
-        chunk_embeddings = await encode_query(chunks)
-        emb = np.mean(chunk_embeddings, axis=0).astype(np.float32)
+            if store_chunks:
+                async with get_ingest_semaphore():
+                    pipe = r_client.pipeline(transaction=False)
+                    for i, (offset, chunk_emb) in enumerate(
+                        zip(offsets, chunk_embeddings), start=chunk_count
+                    ):
+                        pipe.hset(
+                            f"{CHUNK_PREFIX}{content_hash}:{i}",
+                            mapping={
+                                "embedding_" + ENV: chunk_emb.tobytes(),
+                                "parent": content_hash,
+                                "owners": owners_tag,
+                                "offset": offset,
+                            },
+                        )
+                    await pipe.execute()
 
-        file_doc.embedding = emb.tolist()
+            chunk_count += len(batch)
+            del chunk_embeddings
+
+        if not chunk_count:
+            return
+
+        emb = (emb_sum / chunk_count).astype(np.float32)
+        file_doc.embedding = pack_embedding(emb)
         await file_doc.save()
+        local_store.upsert(str(file_doc.owner.ref.id), str(file_doc.id), emb)
 
         async with get_ingest_semaphore():
-            if not await r_client.exists(redis_key):
+            if store_chunks:
                 await r_client.hset(
                     redis_key,
                     mapping={
                         "embedding_" + ENV: emb.tobytes(),
                         "filename": file_doc.file_name,
+                        "owners": owners_tag,
+                        "chunks": chunk_count,
                     },
                 )
+            else:
+                await set_document_owners(r_client, {content_hash: owners})
     except Exception as e:
         logger.error(f"Failed to ingest file {file_id}: {e}")
+        raise
 
 
-async def sync_files_to_redis(r_client, fs, file_ids: list[str]):
+async def sync_files_to_redis(r_client, file_ids: list[str]):
     from src import logger
 
+    from .queue import ingest_queue
+
     logger.info(f"Background sync initiated for {len(file_ids)} file(s).")
 
     async def sync_single_file(file_id):
@@ -79,26 +299,73 @@ async def sync_files_to_redis(r_client, fs, file_ids: list[str]):
             if not (file and file.gridfs_id):
                 return
 
-            if not file.embedding or not file.content_hash:
-                logger.info(f"Re-ingesting file {file_id} due to missing data.")
-                await ingest_file_to_redis(r_client, fs, str(file.id))
-                return
-
-            embd_list = np.array(file.embedding, dtype=np.float32)
-            embd_bytes = embd_list.tobytes()
             redis_key = f"{DOC_PREFIX}{file.content_hash}"
-
             async with get_ingest_semaphore():
-                if not await r_client.exists(redis_key):
-                    await r_client.hset(
-                        redis_key,
-                        mapping={
-                            "embedding_" + ENV: embd_bytes,
-                            "filename": file.file_name,
-                        },
-                    )
+                has_chunks = file.content_hash and await r_client.hexists(
+                    redis_key, "chunks"
+                )
+
+            if not file.embedding or not has_chunks:
+                logger.info(f"Re-ingesting file {file_id} due to missing data.")
+                await ingest_queue.enqueue(r_client, [str(file.id)])
         except Exception as e:
             logger.error(f"Failed to sync file {file_id} to Redis: {e}")
 
     tasks = [sync_single_file(file_id) for file_id in file_ids]
     await asyncio.gather(*tasks)
+
+
+async def backfill_chunk_vectors(r_client):
+    from src import logger
+
+    from .queue import ingest_queue
+
+    if await r_client.exists(CHUNK_BACKFILL_KEY):
+        return
+
+    files = await File.find(File.content_hash != None).project(FileHash).to_list()
+
+    async with get_ingest_semaphore():
+        pipe = r_client.pipeline(transaction=False)
+        for file in files:
+            pipe.hmget(f"{DOC_PREFIX}{file.content_hash}", "chunks", "owners")
+        doc_fields = await pipe.execute()
+
+    pending = {}
+    missing_owners = set()
+    for file, (chunks, owners) in zip(files, doc_fields):
+        if not chunks:
+            pending.setdefault(file.content_hash, str(file.id))
+        elif not owners:
+            missing_owners.add(file.content_hash)
+
+    if missing_owners:
+        owners = await get_document_owners(missing_owners)
+        async with get_ingest_semaphore():
+            await set_document_owners(r_client, owners)
+
+    if pending:
+        logger.info(f"Backfilling chunk vectors for {len(pending)} document(s).")
+        await ingest_queue.enqueue(r_client, list(pending.values()))
+
+    await r_client.set(CHUNK_BACKFILL_KEY, int(time()))
+
+
+async def requeue_unembedded_files(r_client):
+    from src import logger
+
+    from .queue import ingest_queue
+
+    if not await ingest_queue.claim_sweep(r_client):
+        return
+
+    files = (
+        await File.find(File.embedding == None, File.gridfs_id != None)
+        .project(FileEmbedding)
+        .to_list()
+    )
+    # files with a status are queued, running, finished or dead-lettered already
+    file_ids = await ingest_queue.untracked(r_client, [str(file.id) for file in files])
+    if file_ids:
+        logger.info(f"Requeueing {len(file_ids)} file(s) missing embeddings.")
+        await ingest_queue.enqueue(r_client, file_ids)
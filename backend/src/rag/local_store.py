@@ -0,0 +1,151 @@
+import asyncio
+from collections import OrderedDict
+from time import perf_counter
+
+import numpy as np
+from bson import ObjectId
+
+
+class OwnerVectors:
+    def __init__(self, emb_dim: int, capacity: int = 64):
+        self.ids = []
+        self.positions = {}
+        self.matrix = np.zeros((capacity, emb_dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, file_id: str, embedding: np.ndarray):
+        row = self.positions.get(file_id)
+        if row is None:
+            row = len(self.ids)
+            if row == self.matrix.shape[0]:
+                grown = np.zeros(
+                    (self.matrix.shape[0] * 2, self.matrix.shape[1]), dtype=np.float32
+                )
+                grown[:row] = self.matrix
+                self.matrix = grown
+            self.ids.append(file_id)
+            self.positions[file_id] = row
+
+        norm = np.linalg.norm(embedding)
+        self.matrix[row] = embedding / norm if norm else embedding
+
+    def remove(self, file_id: str):
+        row = self.positions.pop(file_id, None)
+        if row is None:
+            return
+
+        last = len(self.ids) - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.positions[moved_id] = row
+            self.matrix[row] = self.matrix[last]
+        self.ids.pop()
+        self.matrix[last] = 0
+
+    def search(self, query: np.ndarray, k: int):
+        size = len(self.ids)
+        if not size:
+            return []
+
+        scores = self.matrix[:size] @ query
+        if size > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(size)
+        top = top[np.argsort(-scores[top])]
+
+        return [{"id": self.ids[i], "score": float((1 + scores[i]) / 2)} for i in top]
+
+
+class LocalVectorStore:
+    def __init__(self, emb_dim: int, max_owners: int):
+        self.emb_dim = emb_dim
+        self.max_owners = max_owners
+        self.owners = OrderedDict()
+        self.loading = {}
+        self.pending = {}
+
+        self.loads = 0
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    async def _load(self, owner_id: str) -> OwnerVectors:
+        from src.models import File
+        from src.models.file import unpack_embedding
+
+        vectors = OwnerVectors(self.emb_dim)
+        cursor = File.get_pymongo_collection().find(
+            {"owner.$id": ObjectId(owner_id), "embedding": {"$ne": None}},
+            {"embedding": 1},
+        )
+        async for doc in cursor:
+            vectors.upsert(str(doc["_id"]), unpack_embedding(doc["embedding"]))
+
+        for op, file_id, embedding in self.pending.pop(owner_id, []):
+            if op == "upsert":
+                vectors.upsert(file_id, embedding)
+            else:
+                vectors.remove(file_id)
+
+        self.owners[owner_id] = vectors
+        while len(self.owners) > self.max_owners:
+            self.owners.popitem(last=False)
+
+        self.loads += 1
+        return vectors
+
+    async def _get(self, owner_id: str) -> OwnerVectors:
+        vectors = self.owners.get(owner_id)
+        if vectors is not None:
+            self.owners.move_to_end(owner_id)
+            return vectors
+
+        task = self.loading.get(owner_id)
+        if task is None:
+            self.pending[owner_id] = []
+            task = asyncio.create_task(self._load(owner_id))
+            self.loading[owner_id] = task
+        try:
+            return await task
+        finally:
+            self.loading.pop(owner_id, None)
+            self.pending.pop(owner_id, None)
+
+    def upsert(self, owner_id: str, file_id: str, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if owner_id in self.owners:
+            self.owners[owner_id].upsert(file_id, embedding)
+        elif owner_id in self.pending:
+            self.pending[owner_id].append(("upsert", file_id, embedding))
+
+    def remove(self, owner_id: str, file_id: str):
+        if owner_id in self.owners:
+            self.owners[owner_id].remove(file_id)
+        elif owner_id in self.pending:
+            self.pending[owner_id].append(("remove", file_id, None))
+
+    async def search(self, owner_id: str, query, k: int):
+        vectors = await self._get(owner_id)
+
+        started = perf_counter()
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        results = vectors.search(query / norm if norm else query, k)
+        self.searches += 1
+        self.search_seconds += perf_counter() - started
+        return results
+
+    def stats(self):
+        return {
+            "owners_loaded": len(self.owners),
+            "max_owners": self.max_owners,
+            "vectors": sum(len(vectors) for vectors in self.owners.values()),
+            "loads": self.loads,
+            "searches": self.searches,
+            "avg_search_ms": (
+                self.search_seconds / self.searches * 1000 if self.searches else 0.0
+            ),
+        }
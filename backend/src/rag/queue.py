@@ -0,0 +1,331 @@
+import asyncio
+import json
+import os
+import socket
+from time import monotonic, time
+
+from redis.exceptions import RedisError, ResponseError
+
+from . import (
+    INGEST_CLAIM_IDLE_MS,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_POLL_MS,
+    INGEST_QUEUE_PREFIX,
+    INGEST_RETRY_BASE_SECONDS,
+    INGEST_RETRY_MAX_SECONDS,
+    INGEST_SHUTDOWN_GRACE,
+    INGEST_STATUS_TTL,
+    INGEST_SWEEP_SECONDS,
+    INGEST_WORKERS,
+)
+
+# moves a due retry onto the stream in one step so a crash cannot drop it
+RETRY_SCRIPT = """
+if redis.call("ZREM", KEYS[1], ARGV[1]) == 1 then
+    local job = cjson.decode(ARGV[1])
+    redis.call("XADD", KEYS[2], "*", "file_id", job.file_id, "attempts", job.attempts)
+    return 1
+end
+return 0
+"""
+
+
+class IngestQueue:
+    def __init__(
+        self,
+        prefix: str,
+        workers: int,
+        max_attempts: int,
+        retry_base: float,
+        retry_max: float,
+        claim_idle_ms: int,
+        poll_ms: int,
+        status_ttl: int,
+        sweep_seconds: int,
+        shutdown_grace: float,
+    ):
+        self.stream = f"{prefix}jobs"
+        self.retry_key = f"{prefix}retry"
+        self.dead_key = f"{prefix}dead"
+        self.status_prefix = f"{prefix}status:"
+        self.sweep_key = f"{prefix}sweep"
+        self.group = "ingest"
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.claim_idle_ms = claim_idle_ms
+        self.poll_ms = poll_ms
+        self.status_ttl = status_ttl
+        self.sweep_seconds = sweep_seconds
+        self.shutdown_grace = shutdown_grace
+        self.stopping = asyncio.Event()
+        self.tasks = []
+        self.scheduler = None
+
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.reclaimed = 0
+
+    def _status(self, pipe, file_id: str, state: str, attempts: int, error=""):
+        key = f"{self.status_prefix}{file_id}"
+        pipe.hset(
+            key,
+            mapping={
+                "state": state,
+                "attempts": attempts,
+                "error": error,
+                "updated_at": int(time()),
+            },
+        )
+        pipe.expire(key, self.status_ttl)
+
+    async def enqueue(self, r_client, file_ids: list[str], attempts: int = 0):
+        if not file_ids:
+            return
+
+        pipe = r_client.pipeline(transaction=False)
+        for file_id in file_ids:
+            pipe.xadd(self.stream, {"file_id": file_id, "attempts": attempts})
+            self._status(pipe, file_id, "queued", attempts)
+        try:
+            await pipe.execute()
+        except RedisError as e:
+            from src import logger
+
+            logger.warning(
+                f"Could not queue {len(file_ids)} file(s) for ingest, "
+                f"they will be requeued on the next start: {e}"
+            )
+
+    async def claim_sweep(self, r_client) -> bool:
+        # every worker sweeps on start, so only the first one in a window does it
+        return bool(
+            await r_client.set(
+                self.sweep_key, int(time()), nx=True, ex=self.sweep_seconds
+            )
+        )
+
+    async def untracked(self, r_client, file_ids: list[str]) -> list[str]:
+        pipe = r_client.pipeline(transaction=False)
+        for file_id in file_ids:
+            pipe.exists(f"{self.status_prefix}{file_id}")
+        tracked = await pipe.execute()
+        return [file_id for file_id, found in zip(file_ids, tracked) if not found]
+
+    async def status(self, r_client, file_id: str) -> dict | None:
+        values = await r_client.hgetall(f"{self.status_prefix}{file_id}")
+        if not values:
+            return None
+        return {key.decode(): value.decode() for key, value in values.items()}
+
+    async def start(self, r_client, fs):
+        try:
+            await r_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        self.stopping.clear()
+        self.tasks = [
+            asyncio.create_task(self._work(r_client, fs, f"{self.consumer}-{i}"))
+            for i in range(self.workers)
+        ]
+        self.scheduler = asyncio.create_task(self._schedule_retries(r_client))
+
+    async def stop(self):
+        # workers finish their current job, and ones still running after the
+        # grace period hand it back to the stream when cancelled
+        self.stopping.set()
+        if self.tasks:
+            _, running = await asyncio.wait(self.tasks, timeout=self.shutdown_grace)
+            for task in running:
+                task.cancel()
+        if self.scheduler:
+            self.scheduler.cancel()
+            self.tasks.append(self.scheduler)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.scheduler = None
+
+    async def _work(self, r_client, fs, consumer: str):
+        from src import logger
+
+        next_claim = 0.0
+        while not self.stopping.is_set():
+            try:
+                messages = []
+                reclaimed = False
+                if monotonic() >= next_claim:
+                    next_claim = monotonic() + self.claim_idle_ms / 2000
+                    _, messages, *_ = await r_client.xautoclaim(
+                        self.stream,
+                        self.group,
+                        consumer,
+                        self.claim_idle_ms,
+                        start_id="0-0",
+                        count=1,
+                    )
+                    self.reclaimed += len(messages)
+                    reclaimed = bool(messages)
+                if not messages:
+                    response = await r_client.xreadgroup(
+                        self.group,
+                        consumer,
+                        {self.stream: ">"},
+                        count=1,
+                        block=self.poll_ms,
+                    )
+                    messages = response[0][1] if response else []
+
+                for message_id, fields in messages:
+                    if not fields:
+                        continue
+                    deliveries = 1
+                    if reclaimed:
+                        deliveries = await self._deliveries(r_client, message_id)
+                    await self._handle(r_client, fs, message_id, fields, deliveries)
+            except asyncio.CancelledError:
+                raise
+            except RedisError as e:
+                logger.warning(f"Ingest worker {consumer} Redis error: {e}")
+                await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Ingest worker {consumer} error: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def _deliveries(self, r_client, message_id) -> int:
+        pending = await r_client.xpending_range(
+            self.stream, self.group, min=message_id, max=message_id, count=1
+        )
+        return pending[0]["times_delivered"] if pending else 1
+
+    def _dead_letter(self, pipe, file_id: str, attempts: int, error: str):
+        pipe.lpush(
+            self.dead_key,
+            json.dumps(
+                {
+                    "file_id": file_id,
+                    "attempts": attempts,
+                    "error": error,
+                    "failed_at": int(time()),
+                }
+            ),
+        )
+        if file_id:
+            self._status(pipe, file_id, "dead", attempts, error)
+        self.dead_lettered += 1
+
+    async def _handle(self, r_client, fs, message_id, fields, deliveries=1):
+        from src import logger
+
+        from .ingest import ingest_file_to_redis
+
+        pipe = r_client.pipeline(transaction=False)
+        try:
+            file_id = fields[b"file_id"].decode()
+            attempts = int(fields.get(b"attempts", 0)) + deliveries
+        except (KeyError, ValueError, UnicodeDecodeError) as e:
+            logger.error(f"Dropping malformed ingest message {message_id}: {fields}")
+            raw = {
+                key.decode(errors="replace"): value.decode(errors="replace")
+                for key, value in fields.items()
+            }
+            self._dead_letter(pipe, "", 0, f"Malformed message {raw}: {e!r}")
+            await self._ack(pipe, message_id)
+            return
+
+        if attempts > self.max_attempts:
+            error = f"Worker lost the job after {deliveries} deliveries"
+            logger.error(f"Ingestion of {file_id} abandoned: {error}")
+            self._dead_letter(pipe, file_id, attempts - 1, error)
+            await self._ack(pipe, message_id)
+            return
+
+        status_pipe = r_client.pipeline(transaction=False)
+        self._status(status_pipe, file_id, "processing", attempts)
+        await status_pipe.execute()
+
+        try:
+            await ingest_file_to_redis(r_client, fs, file_id)
+        except asyncio.CancelledError:
+            # shutdown interrupted the job, which does not count as an attempt
+            pipe.xadd(self.stream, {"file_id": file_id, "attempts": attempts - 1})
+            self._status(pipe, file_id, "queued", attempts - 1)
+            await self._ack(pipe, message_id)
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if attempts >= self.max_attempts:
+                logger.error(f"Ingestion of {file_id} failed {attempts} times: {e}")
+                self._dead_letter(pipe, file_id, attempts, error)
+            else:
+                delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+                job = json.dumps({"file_id": file_id, "attempts": attempts})
+                pipe.zadd(self.retry_key, {job: time() + delay})
+                self._status(pipe, file_id, "retrying", attempts, error)
+                self.retried += 1
+        else:
+            self._status(pipe, file_id, "done", attempts)
+            self.processed += 1
+
+        await self._ack(pipe, message_id)
+
+    async def _ack(self, pipe, message_id):
+        pipe.xack(self.stream, self.group, message_id)
+        pipe.xdel(self.stream, message_id)
+        await pipe.execute()
+
+    async def _schedule_retries(self, r_client):
+        from src import logger
+
+        move_due = r_client.register_script(RETRY_SCRIPT)
+        while True:
+            try:
+                due = await r_client.zrangebyscore(
+                    self.retry_key, "-inf", time(), start=0, num=100
+                )
+                for job in due:
+                    await move_due(keys=[self.retry_key, self.stream], args=[job])
+            except asyncio.CancelledError:
+                raise
+            except RedisError as e:
+                logger.warning(f"Ingest retry scheduler Redis error: {e}")
+            await asyncio.sleep(1)
+
+    async def stats(self, r_client):
+        pipe = r_client.pipeline(transaction=False)
+        pipe.xlen(self.stream)
+        pipe.xpending(self.stream, self.group)
+        pipe.zcard(self.retry_key)
+        pipe.llen(self.dead_key)
+        queued, pending, retrying, dead = await pipe.execute()
+
+        return {
+            "workers": self.workers,
+            "queued": queued,
+            "in_flight": pending["pending"] if pending else 0,
+            "retrying": retrying,
+            "dead_letters": dead,
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "reclaimed": self.reclaimed,
+        }
+
+
+ingest_queue = IngestQueue(
+    INGEST_QUEUE_PREFIX,
+    INGEST_WORKERS,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_RETRY_BASE_SECONDS,
+    INGEST_RETRY_MAX_SECONDS,
+    INGEST_CLAIM_IDLE_MS,
+    INGEST_POLL_MS,
+    INGEST_STATUS_TTL,
+    INGEST_SWEEP_SECONDS,
+    INGEST_SHUTDOWN_GRACE,
+)
@@ -0,0 +1,110 @@
+import asyncio
+from time import perf_counter
+
+import numpy as np
+
+
+class EmbeddingScheduler:
+    def __init__(self, encode_fn, emb_dim: int, window_ms: float, max_batch: int):
+        self.encode_fn = encode_fn
+        self.emb_dim = emb_dim
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = None
+        self.worker = None
+
+        self.requests = 0
+        self.batches = 0
+        self.batch_size_histogram = {}
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _ensure_worker(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+    async def submit(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.empty((0, self.emb_dim), dtype=np.float32)
+
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((list(texts), future, perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            pending = [item]
+            size = len(item[0])
+            deadline = loop.time() + self.window
+
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            await self._dispatch(pending)
+
+    async def _dispatch(self, pending):
+        pending = [item for item in pending if not item[1].done()]
+        if not pending:
+            return
+
+        started = perf_counter()
+        texts = []
+        for item_texts, _, enqueued_at in pending:
+            texts.extend(item_texts)
+            wait = started - enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        self.requests += len(pending)
+        self.batches += 1
+        bucket = 1
+        while bucket < len(texts):
+            bucket *= 2
+        self.batch_size_histogram[bucket] = self.batch_size_histogram.get(bucket, 0) + 1
+
+        try:
+            embeddings = await self.encode_fn(texts)
+        except Exception as e:
+            for _, future, _ in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for item_texts, future, _ in pending:
+            rows = embeddings[offset : offset + len(item_texts)]
+            offset += len(item_texts)
+            if not future.done():
+                future.set_result(rows)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "batch_size_histogram": {
+                f"<={bucket}": count
+                for bucket, count in sorted(self.batch_size_histogram.items())
+            },
+            "avg_wait_ms": (
+                self.total_wait / self.requests * 1000 if self.requests else 0.0
+            ),
+            "max_wait_ms": self.max_wait * 1000,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+        }
@@ -4,49 +4,88 @@ from src.client import get_redis_client
 from src.middleware.limits import ENV
 from src.models import File, User
 
-from . import INDEX_NAME, TOP_K
+from . import (
+    CHUNK_AGGREGATION,
+    CHUNK_AGGREGATION_TOP,
+    CHUNK_CANDIDATES,
+    CHUNK_INDEX_NAME,
+    DOC_PREFIX,
+    HNSW_EF_RUNTIME,
+    INDEX_NAME,
+    TOP_K,
+    VECTOR_ALGORITHM,
+    local_store,
+)
 from .manager import get_search_semaphore
 
 
-async def perform_redis_search(embedding: bytes):
+def _aggregate_chunk_scores(scores: list[float]) -> float:
+    if CHUNK_AGGREGATION == "sum":
+        return sum(sorted(scores, reverse=True)[:CHUNK_AGGREGATION_TOP])
+    return max(scores)
+
+
+async def perform_redis_search(embedding: bytes, owner_id: str):
     r_client = get_redis_client()
 
-    query_string = f"*=>[KNN {TOP_K} @embedding_{ENV} $vec AS distance]"
+    # EF_RUNTIME is a query-time knob, so it can be tuned without a reindex
+    ef_runtime = "EF_RUNTIME $ef " if VECTOR_ALGORITHM == "HNSW" else ""
+    query_string = (
+        f"@owners:{{{owner_id}}}"
+        f"=>[KNN {CHUNK_CANDIDATES} @embedding_{ENV} $vec {ef_runtime}AS distance]"
+    )
+    params = ["vec", embedding]
+    if ef_runtime:
+        params += ["ef", HNSW_EF_RUNTIME]
+
     command_args = [
         "FT.SEARCH",
-        INDEX_NAME,
+        CHUNK_INDEX_NAME,
         query_string,
         "PARAMS",
-        "2",
-        "vec",
-        embedding,
-        "DIALECT",
-        "2",
+        len(params),
+        *params,
         "RETURN",
-        "1",
+        "3",
         "distance",
+        "parent",
+        "offset",
+        "LIMIT",
+        "0",
+        CHUNK_CANDIDATES,
+        "DIALECT",
+        "2",
     ]
 
     async with get_search_semaphore():
         raw_results = await r_client.execute_command(*command_args)
 
-    results = []
-    keys_to_touch = []
+    matches = {}
     i = 1
     while i < len(raw_results):
-        doc_id = raw_results[i]
-        keys_to_touch.append(doc_id)
+        fields = dict(zip(raw_results[i + 1][::2], raw_results[i + 1][1::2]))
+        content_hash = fields[b"parent"].decode("utf-8")
+        score = 1 / (1 + float(fields[b"distance"]))
+        matches.setdefault(content_hash, []).append(
+            (score, int(fields.get(b"offset", 0)))
+        )
+        i += 2
 
-        distance = float(raw_results[i + 1][1])
-        results.append(
+    results = sorted(
+        (
             {
-                "hash": doc_id.decode("utf-8").split(":")[1],
-                "score": 1 / (1 + distance),
+                "hash": content_hash,
+                "score": _aggregate_chunk_scores([score for score, _ in hits]),
+                "offsets": [offset for _, offset in sorted(hits, reverse=True)],
             }
-        )
-        i += 2
+            for content_hash, hits in matches.items()
+        ),
+        key=lambda res: res["score"],
+        reverse=True,
+    )[:TOP_K]
 
     # After getting the results, touch the keys to update the LRU status
+    keys_to_touch = [f"{DOC_PREFIX}{res['hash']}" for res in results]
     if keys_to_touch:
         async with get_search_semaphore():
             try:
@@ -86,3 +125,7 @@ async def perform_mongodb_search(embeddings, user: User):
 
     results = await File.aggregate(pipeline).to_list()
     return results
+
+
+async def perform_local_search(embeddings, user: User):
+    return await local_store.search(str(user.id), embeddings, TOP_K)
@@ -0,0 +1,80 @@
+from collections import Counter
+
+from bson import ObjectId
+from gridfs.errors import FileExists
+from pymongo import UpdateOne
+
+BLOB_BLOCK_SIZE = 255 * 1024
+BLOB_HASH_KEY = "metadata.sha256"
+BLOB_REFS_KEY = "metadata.refcount"
+
+
+async def init_blob_index(db):
+    await db["fs.files"].create_index(
+        BLOB_HASH_KEY,
+        unique=True,
+        partialFilterExpression={BLOB_HASH_KEY: {"$exists": True}},
+    )
+
+
+async def acquire_blob(db, content_hash: str, count: int = 1) -> str | None:
+    blob = await db["fs.files"].find_one_and_update(
+        {BLOB_HASH_KEY: content_hash},
+        {"$inc": {BLOB_REFS_KEY: count}},
+        projection={"_id": 1},
+    )
+    return str(blob["_id"]) if blob else None
+
+
+async def iter_bytes(data: bytes):
+    for start in range(0, len(data), BLOB_BLOCK_SIZE):
+        yield data[start : start + BLOB_BLOCK_SIZE]
+
+
+async def store_blob(fs, db, file_name, content_hash, mime_type, blocks) -> str:
+    grid_in = fs.open_upload_stream(
+        file_name,
+        metadata={"contentType": mime_type, "sha256": content_hash, "refcount": 1},
+    )
+    try:
+        async for block in blocks:
+            await grid_in.write(block)
+        await grid_in.close()
+    except FileExists:
+        # a concurrent upload stored the same content first
+        await grid_in.abort()
+        blob_id = await acquire_blob(db, content_hash)
+        if blob_id is None:
+            raise
+        return blob_id
+    except Exception:
+        await grid_in.abort()
+        raise
+    return str(grid_in._id)
+
+
+async def release_blobs(db, gridfs_ids: list[str]):
+    refs = Counter(gridfs_ids)
+    if not refs:
+        return
+
+    await db["fs.files"].bulk_write(
+        [
+            UpdateOne({"_id": ObjectId(id)}, {"$inc": {BLOB_REFS_KEY: -count}})
+            for id, count in refs.items()
+        ],
+        ordered=False,
+    )
+
+    ids = [ObjectId(id) for id in refs]
+    orphan_query = {"_id": {"$in": ids}, BLOB_REFS_KEY: {"$lte": 0}}
+    orphans = await db["fs.files"].distinct("_id", orphan_query)
+    if not orphans:
+        return
+
+    await db["fs.files"].delete_many({**orphan_query, "_id": {"$in": orphans}})
+    # a blob re-acquired since the lookup keeps its files doc and its chunks
+    kept = await db["fs.files"].distinct("_id", {"_id": {"$in": orphans}})
+    orphans = [id for id in orphans if id not in kept]
+    if orphans:
+        await db["fs.chunks"].delete_many({"files_id": {"$in": orphans}})
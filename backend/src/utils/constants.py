@@ -8,6 +8,17 @@ ALLOWED_MIME_TYPES = [
     "text/plain",
     "text/csv",
 ]
+MIME_SNIFF_BYTES = 8192
+BULK_UPLOAD_CONCURRENCY = 4
+FOLDER_PATH_CACHE_TTL = 10 * 60
+FOLDER_PATH_CACHE_SIZE = 256
+ZIP_STORED_MIME_TYPES = [
+    "application/pdf",
+]
+# byte ranges and ETags refer to the stored bytes, so these stay uncompressed
+GZIP_EXCLUDED_PATHS = [
+    r"^/file/[^/]+$",
+]
 REQUIRED_APP_VARS = [
     "USER_LIMIT",
     "CLUSTER_NAME",
@@ -1,5 +1,6 @@
 import asyncio
 import csv
+import hashlib
 import random
 from io import BytesIO, StringIO
 
@@ -51,8 +52,10 @@ async def create_and_ingest_file(
 ) -> int | None:
     from faker import Faker
 
+    from src.client import get_db
     from src.models import File
-    from src.rag.ingest import ingest_file_to_redis
+    from src.rag.queue import ingest_queue
+    from src.utils.blobs import acquire_blob, iter_bytes, store_blob
 
     fake = Faker()
     theme = random.choice(list(THEMATIC_CONTENT.keys()))
@@ -82,19 +85,24 @@ async def create_and_ingest_file(
     if total_size_generated + file_size > remaining_size_to_add:
         return None
 
-    gridfs_id = await fs.upload_from_stream(
-        file_name, BytesIO(contents), metadata={"contentType": mime_type}
-    )
+    content_hash = hashlib.sha256(contents).hexdigest()
+    db = get_db()
+    gridfs_id = await acquire_blob(db, content_hash)
+    if gridfs_id is None:
+        gridfs_id = await store_blob(
+            fs, db, file_name, content_hash, mime_type, iter_bytes(contents)
+        )
     new_file = File(
         file_name=file_name,
         file_type=mime_type,
         file_size=file_size,
         owner=guest_user,
         folder=target_folder,
-        gridfs_id=str(gridfs_id),
+        gridfs_id=gridfs_id,
+        content_hash=content_hash,
     )
     await new_file.insert()
-    await ingest_file_to_redis(r_client, fs, str(new_file.id))
+    await ingest_queue.enqueue(r_client, [str(new_file.id)])
     return file_size
 
 
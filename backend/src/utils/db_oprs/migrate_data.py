@@ -0,0 +1,286 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+MIGRATION_BATCH_SIZE = 500
+MIGRATION_MARKERS = "migrations"
+MIGRATION_HEARTBEAT = 10
+MIGRATION_STALE_AFTER = timedelta(seconds=6 * MIGRATION_HEARTBEAT)
+
+
+async def _claim_migration(markers, name: str) -> bool:
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            await markers.insert_one(
+                {"_id": name, "state": "running", "heartbeat_at": now}
+            )
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # a worker that died mid-run stops its heartbeat, so its claim can be taken
+        if await markers.find_one_and_update(
+            {
+                "_id": name,
+                "state": "running",
+                "heartbeat_at": {"$lt": now - MIGRATION_STALE_AFTER},
+            },
+            {"$set": {"heartbeat_at": now}},
+        ):
+            return True
+
+        marker = await markers.find_one({"_id": name}, {"state": 1})
+        if marker and marker.get("state") != "running":
+            return False
+        # wait for the other worker so callers can rely on the migration result
+        await asyncio.sleep(1)
+
+
+async def _keep_claim(markers, name: str):
+    while True:
+        await asyncio.sleep(MIGRATION_HEARTBEAT)
+        await markers.update_one(
+            {"_id": name, "state": "running"},
+            {"$set": {"heartbeat_at": datetime.now(timezone.utc)}},
+        )
+
+
+def run_once(name: str):
+    def decorator(migration):
+        @wraps(migration)
+        async def wrapper(*args, **kwargs):
+            from src.client import get_db
+
+            markers = get_db()[MIGRATION_MARKERS]
+            if not await _claim_migration(markers, name):
+                return None
+
+            heartbeat = asyncio.create_task(_keep_claim(markers, name))
+            try:
+                result = await migration(*args, **kwargs)
+            except BaseException:
+                await markers.delete_one({"_id": name, "state": "running"})
+                raise
+            finally:
+                heartbeat.cancel()
+
+            await markers.update_one(
+                {"_id": name},
+                {
+                    "$set": {
+                        "state": "done",
+                        "completed_at": datetime.now(timezone.utc),
+                    },
+                    "$unset": {"heartbeat_at": ""},
+                },
+            )
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+@run_once("binary_embeddings")
+async def migrate_embeddings():
+    import logging
+
+    from src.models import File
+    from src.models.file import pack_embedding
+
+    logger = logging.getLogger("uvicorn")
+    collection = File.get_pymongo_collection()
+    cursor = collection.find({"embedding": {"$type": "array"}}, {"embedding": 1})
+
+    migrated = 0
+    updates = []
+    async for doc in cursor:
+        updates.append(
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"embedding": pack_embedding(doc["embedding"])}},
+            )
+        )
+        if len(updates) >= MIGRATION_BATCH_SIZE:
+            await collection.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            updates = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+
+    if migrated:
+        logger.info(f"Migrated {migrated} file embedding(s) to binary float32.")
+
+
+@run_once("folder_ancestors")
+async def migrate_folder_ancestors():
+    import logging
+
+    from src.models import Folder
+
+    logger = logging.getLogger("uvicorn")
+    collection = Folder.get_pymongo_collection()
+
+    folders = {}
+    async for doc in collection.find({}, {"parent": 1, "ancestors": 1}):
+        folders[doc["_id"]] = doc
+
+    def ancestors_of(folder_id):
+        chain = []
+        parent = folders[folder_id].get("parent")
+        while parent is not None and parent.id in folders and len(chain) < len(folders):
+            chain.append(parent.id)
+            parent = folders[parent.id].get("parent")
+        return chain[::-1]
+
+    migrated = 0
+    updates = []
+    for folder_id, doc in folders.items():
+        ancestors = ancestors_of(folder_id)
+        if doc.get("ancestors") == ancestors:
+            continue
+        updates.append(
+            UpdateOne({"_id": folder_id}, {"$set": {"ancestors": ancestors}})
+        )
+        if len(updates) >= MIGRATION_BATCH_SIZE:
+            await collection.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            updates = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+
+    if migrated:
+        logger.info(f"Backfilled ancestors for {migrated} folder(s).")
+
+
+async def reconcile_folder_sizes():
+    import logging
+
+    from src.models import File, Folder
+    from src.utils.constants import META_DATA_SIZE
+
+    logger = logging.getLogger("uvicorn")
+    collection = Folder.get_pymongo_collection()
+
+    file_sizes = {}
+    cursor = await File.get_pymongo_collection().aggregate(
+        [
+            {"$match": {"folder": {"$ne": None}}},
+            {"$group": {"_id": "$folder", "total": {"$sum": "$file_size"}}},
+        ]
+    )
+    async for doc in cursor:
+        file_sizes[doc["_id"].id] = doc["total"]
+
+    folders = {}
+    expected = {}
+    async for doc in collection.find({}, {"ancestors": 1, "folder_size": 1}):
+        folders[doc["_id"]] = doc
+        expected[doc["_id"]] = 0
+
+    for folder_id, doc in folders.items():
+        size = META_DATA_SIZE + file_sizes.get(folder_id, 0)
+        for id in [folder_id, *doc.get("ancestors", [])]:
+            if id in expected:
+                expected[id] += size
+
+    drifted = 0
+    updates = []
+    for folder_id, size in expected.items():
+        delta = size - (folders[folder_id].get("folder_size") or 0)
+        if not delta:
+            continue
+        updates.append(UpdateOne({"_id": folder_id}, {"$inc": {"folder_size": delta}}))
+        if len(updates) >= MIGRATION_BATCH_SIZE:
+            await collection.bulk_write(updates, ordered=False)
+            drifted += len(updates)
+            updates = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        drifted += len(updates)
+
+    if drifted:
+        logger.warning(f"Reconciled folder_size drift on {drifted} folder(s).")
+    return drifted
+
+
+@run_once("folder_sizes")
+async def backfill_folder_sizes():
+    # folder_size was never maintained before subtree totals, so fill it in once
+    return await reconcile_folder_sizes()
+
+
+@run_once("blob_refs")
+async def migrate_blob_refs():
+    import logging
+
+    from bson import ObjectId
+
+    from src.client import get_db
+    from src.models import File
+    from src.utils.blobs import BLOB_HASH_KEY, BLOB_REFS_KEY, release_blobs
+
+    logger = logging.getLogger("uvicorn")
+    db = get_db()
+    collection = File.get_pymongo_collection()
+
+    legacy_ids = [
+        str(doc["_id"])
+        async for doc in db["fs.files"].find(
+            {BLOB_HASH_KEY: {"$exists": False}}, {"_id": 1}
+        )
+    ]
+    if not legacy_ids:
+        return
+
+    files_by_hash = {}
+    for start in range(0, len(legacy_ids), MIGRATION_BATCH_SIZE):
+        cursor = collection.find(
+            {
+                "gridfs_id": {"$in": legacy_ids[start : start + MIGRATION_BATCH_SIZE]},
+                "content_hash": {"$ne": None},
+            },
+            {"gridfs_id": 1, "content_hash": 1},
+        )
+        async for doc in cursor:
+            files_by_hash.setdefault(doc["content_hash"], []).append(doc)
+
+    merged = 0
+    for content_hash, docs in files_by_hash.items():
+        blob = await db["fs.files"].find_one_and_update(
+            {BLOB_HASH_KEY: content_hash},
+            {"$inc": {BLOB_REFS_KEY: len(docs)}},
+            projection={"_id": 1},
+        )
+        if blob:
+            keeper = str(blob["_id"])
+        else:
+            keeper = docs[0]["gridfs_id"]
+            await db["fs.files"].update_one(
+                {"_id": ObjectId(keeper)},
+                {"$set": {BLOB_HASH_KEY: content_hash, BLOB_REFS_KEY: len(docs)}},
+            )
+
+        duplicates = [doc["gridfs_id"] for doc in docs if doc["gridfs_id"] != keeper]
+        if duplicates:
+            await collection.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in docs]}},
+                {"$set": {"gridfs_id": keeper}},
+            )
+            await release_blobs(db, duplicates)
+            merged += len(duplicates)
+
+    if files_by_hash:
+        logger.info(
+            f"Tracked references for {len(files_by_hash)} GridFS blob(s), "
+            f"merged {merged} duplicate(s)."
+        )
@@ -14,3 +14,11 @@ def raise_storage_exceeded():
     raise HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST, detail="Storage quota exceeded"
     )
+
+
+def raise_range_not_satisfiable(size: int):
+    raise HTTPException(
+        status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+        detail="Requested range not satisfiable",
+        headers={"Content-Range": f"bytes */{size}"},
+    )
@@ -0,0 +1,97 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+
+from beanie import PydanticObjectId
+from beanie.operators import In
+
+from src.models import Folder, ref_id
+
+from .constants import FOLDER_PATH_CACHE_SIZE, FOLDER_PATH_CACHE_TTL
+
+
+def folder_path_of(file_path: str) -> str:
+    return "/".join(part for part in file_path.split("/")[:-1] if part)
+
+
+def _with_prefixes(dir_paths) -> set[str]:
+    paths = set()
+    for dir_path in dir_paths:
+        parts = [part for part in dir_path.split("/") if part]
+        for depth in range(1, len(parts) + 1):
+            paths.add("/".join(parts[:depth]))
+    return paths
+
+
+class FolderPathCache:
+    def __init__(self, ttl: int, max_batches: int):
+        self.ttl = ttl
+        self.max_batches = max_batches
+        self.batches = OrderedDict()
+
+    def get(self, key, root: Folder):
+        entry = self.batches.get(key)
+        if entry is None or entry[0] < monotonic():
+            entry = (0, {"": root}, asyncio.Lock())
+
+        self.batches[key] = (monotonic() + self.ttl, entry[1], entry[2])
+        self.batches.move_to_end(key)
+        while len(self.batches) > self.max_batches:
+            self.batches.popitem(last=False)
+        return entry[1], entry[2]
+
+
+path_cache = FolderPathCache(FOLDER_PATH_CACHE_TTL, FOLDER_PATH_CACHE_SIZE)
+
+
+async def _resolve(root: Folder, owner, dir_paths, known: dict):
+    missing = sorted(
+        (path for path in _with_prefixes(dir_paths) if path not in known),
+        key=lambda path: path.count("/"),
+    )
+    if not missing:
+        return known, []
+
+    existing = await Folder.find(
+        Folder.ancestors == root.id,
+        In(Folder.name, list({path.rpartition("/")[2] for path in missing})),
+        Folder.owner.id == owner.id,
+    ).to_list()
+    by_parent_and_name = {
+        (ref_id(folder.parent), folder.name): folder for folder in existing
+    }
+
+    folders = dict(known)
+    created = []
+    for path in missing:
+        parent = folders[folder_path_of(path)]
+        name = path.rpartition("/")[2]
+        folder = by_parent_and_name.get((parent.id, name))
+        if folder is None:
+            folder = Folder(
+                id=PydanticObjectId(),
+                name=name,
+                owner=owner,
+                parent=parent,
+                ancestors=[*parent.ancestors, parent.id],
+            )
+            created.append((parent, folder))
+        folders[path] = folder
+
+    if created:
+        await Folder.insert_many([folder for _, folder in created])
+        await Folder.add_sizes(
+            [(parent, folder.folder_size) for parent, folder in created]
+        )
+
+    known.update(folders)
+    return known, [folder for _, folder in created]
+
+
+async def resolve_folder_paths(root: Folder, owner, dir_paths, batch_id=None):
+    if not batch_id:
+        return await _resolve(root, owner, dir_paths, {"": root})
+
+    folders, lock = path_cache.get((str(owner.id), str(root.id), batch_id), root)
+    async with lock:
+        return await _resolve(root, owner, dir_paths, folders)
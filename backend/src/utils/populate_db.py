@@ -1,5 +1,18 @@
 from .db_oprs.init_data import create_guest_data
 from .db_oprs.init_users import create_initial_users
+from .db_oprs.migrate_data import (
+    backfill_folder_sizes,
+    migrate_blob_refs,
+    migrate_embeddings,
+    migrate_folder_ancestors,
+)
+
+
+async def migrate_folder_tree():
+    # folder deletes, path resolution and quota accounting read these, so they
+    # run before serving
+    await migrate_folder_ancestors()
+    await backfill_folder_sizes()
 
 
 async def populate_db(app_vars):
@@ -7,6 +20,14 @@ async def populate_db(app_vars):
 
     logger = logging.getLogger("uvicorn")
     logger.info("DB population started")
+    await migrate_embeddings()
+    await migrate_blob_refs()
     await create_initial_users(app_vars)
     await create_guest_data()
+
+    from src.client import get_redis_client
+    from src.rag.ingest import backfill_chunk_vectors, requeue_unembedded_files
+
+    await backfill_chunk_vectors(get_redis_client())
+    await requeue_unembedded_files(get_redis_client())
     logger.info("DB population successfull")
@@ -0,0 +1,111 @@
+import zipfile
+from time import localtime
+
+from bson import ObjectId
+
+from .constants import ZIP_STORED_MIME_TYPES
+
+
+class _ZipSink:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+async def iter_gridfs_file(grid_out, start: int = 0, end: int | None = None):
+    if start:
+        await grid_out.seek(start)
+
+    remaining = None if end is None else end - start + 1
+    while remaining is None or remaining > 0:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        yield chunk
+
+
+def parse_byte_range(header: str | None, size: int):
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+
+    start, sep, end = header[len("bytes=") :].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            start = max(size - int(end), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= size:
+        from .exceptions import raise_range_not_satisfiable
+
+        raise_range_not_satisfiable(size)
+    return start, end
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def stream_zip(fs, entries):
+    import logging
+
+    logger = logging.getLogger("uvicorn")
+    sink = _ZipSink()
+
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        async for arcname, file_doc in entries:
+            if not file_doc.gridfs_id:
+                continue
+            try:
+                grid_out = await fs.open_download_stream(ObjectId(file_doc.gridfs_id))
+                chunks = iter_gridfs_file(grid_out)
+                first = await anext(chunks, b"")
+            except Exception as e:
+                logger.warning(f"Skipping {arcname} in archive: {e}")
+                continue
+
+            info = zipfile.ZipInfo(arcname, date_time=localtime()[:6])
+            info.external_attr = 0o644 << 16
+            if file_doc.file_type in ZIP_STORED_MIME_TYPES:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            force_zip64 = (file_doc.file_size or 0) > zipfile.ZIP64_LIMIT
+            # once an entry has data, a failed read aborts the response rather
+            # than closing the entry with a valid CRC over truncated content
+            with archive.open(info, "w", force_zip64=force_zip64) as dest:
+                dest.write(first)
+                async for chunk in chunks:
+                    dest.write(chunk)
+                    if data := sink.drain():
+                        yield data
+
+            if data := sink.drain():
+                yield data
+
+    if data := sink.drain():
+        yield data
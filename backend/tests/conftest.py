@@ -0,0 +1,8 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+os.environ.setdefault("MAX_CONCURRENT_REQUESTS", "10")
+os.environ.setdefault("MAX_MEMORY_MB", "512")
+os.environ.setdefault("USER_LIMIT", "10")
@@ -0,0 +1,70 @@
+import asyncio
+
+from src.rag import TextChunker, iter_text_chunks
+from src.rag.ingest import _iter_csv_records, _iter_decoded
+
+WORDS = [f"w{i}" for i in range(12)]
+
+
+def chunks_of(text, n=5, overlap=2):
+    return list(iter_text_chunks([text], n=n, overlap=overlap))
+
+
+def test_offsets_point_at_the_first_word_of_each_chunk():
+    for offset, chunk in chunks_of(" ".join(WORDS)):
+        assert chunk.split()[0] == WORDS[offset]
+
+
+def test_consecutive_chunks_overlap():
+    chunks = [chunk.split() for _, chunk in chunks_of(" ".join(WORDS))]
+    assert [len(chunk) for chunk in chunks] == [5, 5, 5, 3]
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous[-2:] == current[:2]
+
+
+def test_no_tail_chunk_when_the_last_window_is_complete():
+    assert [offset for offset, _ in chunks_of(" ".join(WORDS[:8]))] == [0, 3]
+
+
+def test_short_and_empty_text():
+    assert chunks_of("just three words") == [(0, "just three words")]
+    assert chunks_of("   ") == []
+
+
+def test_segments_are_joined_into_one_word_stream():
+    segments = ["w0 w1", "", " w2 w3 w4\n", "w5\tw6 w7 "]
+    expected = chunks_of(" ".join(WORDS[:8]))
+    assert list(iter_text_chunks(segments, n=5, overlap=2)) == expected
+
+
+def test_incremental_feeding_matches_iter_text_chunks():
+    chunker = TextChunker(5, 2)
+    chunks = []
+    for word in WORDS:
+        chunks.extend(chunker.feed(word + " "))
+    chunks.extend(chunker.finish())
+    assert chunks == chunks_of(" ".join(WORDS))
+
+
+async def _blocks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_decoder_keeps_words_and_characters_whole_across_blocks():
+    text = "naïve café straddles every boundary\nsecond line"
+    for size in (1, 2, 3, 5, 8, 64):
+        segments = asyncio.run(_collect(_iter_decoded(_blocks(text.encode(), size))))
+        words = [word for segment in segments for word in segment.split()]
+        assert words == text.split(), size
+
+
+def test_csv_records_keep_quoted_newlines():
+    data = b'name,notes\nada,"first\nsecond"\nbob,plain'
+    for size in (1, 4, 64):
+        records = asyncio.run(_collect(_iter_csv_records(_blocks(data, size))))
+        assert records == ["name,notes", 'ada,"first\nsecond"', "bob,plain"]
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+from time import monotonic
+
+import numpy as np
+
+from src.rag import (
+    ACTIVATION_BYTES_PER_TOKEN,
+    EMBED_UNLOAD_GAP_FACTOR,
+    LifecycleEncoder,
+)
+
+SHORT = "quarterly budget"
+LONG = " ".join(["word"] * 100)
+
+
+def make_encoder(max_batch_size=16, max_batch_tokens=None):
+    encoder = LifecycleEncoder()
+    encoder.max_batch_size = max_batch_size
+    if max_batch_tokens is not None:
+        encoder.max_batch_bytes = max_batch_tokens * ACTIVATION_BYTES_PER_TOKEN
+    return encoder
+
+
+def test_plan_batches_keeps_every_text_in_order():
+    texts = [f"{SHORT} {i}" for i in range(10)] + [LONG, SHORT]
+    batches = make_encoder(max_batch_size=4)._plan_batches(texts)
+    assert [text for batch in batches for text in batch] == texts
+
+
+def test_plan_batches_caps_batch_size():
+    batches = make_encoder(max_batch_size=3)._plan_batches([SHORT] * 7)
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_plan_batches_splits_on_padded_memory_budget():
+    encoder = make_encoder(max_batch_tokens=2 * 128)
+    assert encoder._estimate_tokens(LONG) == 128
+
+    batches = encoder._plan_batches([LONG] * 5)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_plan_batches_pads_short_texts_to_the_longest():
+    encoder = make_encoder(max_batch_tokens=3 * 128)
+    batches = encoder._plan_batches([LONG, SHORT, SHORT, SHORT, SHORT])
+    assert [len(batch) for batch in batches] == [3, 2]
+
+
+def test_plan_batches_empty():
+    assert make_encoder()._plan_batches([]) == []
+
+
+class FakeModel:
+    max_seq_length = 128
+
+    def __init__(self):
+        self.batches = []
+        self.threads = set()
+
+    def encode(self, texts, batch_size, **kwargs):
+        self.batches.append(list(texts))
+        self.threads.add(threading.current_thread().name)
+        return [[len(text), 0.0] for text in texts]
+
+
+def test_encode_batches_run_off_the_event_loop_in_order():
+    encoder = make_encoder(max_batch_size=2)
+    encoder.model = FakeModel()
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+    async def run():
+        return await encoder._run_in_executor(encoder._encode_batches, texts)
+
+    embeddings = asyncio.run(run())
+    assert embeddings.dtype == np.float32
+    assert embeddings[:, 0].tolist() == [1, 2, 3, 4, 5]
+    assert encoder.model.batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+    assert all(name.startswith("encoder") for name in encoder.model.threads)
+
+
+def test_unload_delay_follows_the_request_gap_within_bounds():
+    encoder = make_encoder()
+    encoder.min_unload_delay, encoder.max_unload_delay = 30, 900
+    assert encoder._unload_delay() == 30
+
+    encoder.mean_gap = 1
+    assert encoder._unload_delay() == 30
+    encoder.mean_gap = 60
+    assert encoder._unload_delay() == 60 * EMBED_UNLOAD_GAP_FACTOR
+    encoder.mean_gap = 3600
+    assert encoder._unload_delay() == 900
+
+
+def test_record_use_smooths_the_gap():
+    encoder = make_encoder()
+    encoder._record_use()
+    assert encoder.mean_gap is None
+
+    encoder.last_used = monotonic() - 100
+    encoder._record_use()
+    assert 99 < encoder.mean_gap < 101
+
+    encoder.last_used = monotonic()
+    encoder._record_use()
+    assert 79 < encoder.mean_gap < 81
@@ -0,0 +1,130 @@
+import asyncio
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from src.models import File
+from src.models.file import pack_embedding
+from src.rag.local_store import LocalVectorStore, OwnerVectors
+
+OWNER = str(ObjectId())
+OTHER_OWNER = str(ObjectId())
+
+
+def unit(*values):
+    return np.array(values, dtype=np.float32)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, docs_by_owner):
+        self.docs_by_owner = docs_by_owner
+        self.finds = 0
+
+    def find(self, query, projection):
+        self.finds += 1
+        return FakeCursor(self.docs_by_owner.get(str(query["owner.$id"]), []))
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = FakeCollection(
+        {
+            OWNER: [
+                {"_id": "a", "embedding": pack_embedding(unit(1, 0, 0))},
+                {"_id": "b", "embedding": pack_embedding(unit(0, 1, 0))},
+            ],
+            OTHER_OWNER: [{"_id": "c", "embedding": pack_embedding(unit(0, 0, 1))}],
+        }
+    )
+    monkeypatch.setattr(File, "get_pymongo_collection", lambda: collection)
+    return collection
+
+
+def test_owner_vectors_rank_by_cosine_similarity():
+    vectors = OwnerVectors(3, capacity=1)
+    vectors.upsert("a", unit(2, 0, 0))
+    vectors.upsert("b", unit(1, 1, 0))
+    vectors.upsert("c", unit(0, 0, 3))
+
+    results = vectors.search(unit(1, 0, 0), k=2)
+    assert [result["id"] for result in results] == ["a", "b"]
+    assert results[0]["score"] == pytest.approx(1.0)
+    assert results[1]["score"] == pytest.approx((1 + 2**-0.5) / 2)
+
+
+def test_owner_vectors_upsert_replaces_and_remove_compacts():
+    vectors = OwnerVectors(3)
+    for file_id, vector in [("a", unit(1, 0, 0)), ("b", unit(0, 1, 0))]:
+        vectors.upsert(file_id, vector)
+    vectors.upsert("a", unit(0, 0, 1))
+    vectors.upsert("c", unit(1, 0, 0))
+    vectors.remove("a")
+    vectors.remove("missing")
+
+    assert len(vectors) == 2
+    assert vectors.positions == {"b": 1, "c": 0}
+    assert vectors.search(unit(1, 0, 0), k=1)[0]["id"] == "c"
+    assert vectors.search(unit(0, 0, 1), k=5)[0]["score"] == pytest.approx(0.5)
+
+
+def test_concurrent_searches_share_one_load(collection):
+    async def run():
+        store = LocalVectorStore(3, max_owners=4)
+        results = await asyncio.gather(
+            *(store.search(OWNER, unit(0, 1, 0), k=1) for _ in range(3))
+        )
+        return store, results
+
+    store, results = asyncio.run(run())
+    assert collection.finds == 1
+    assert store.stats()["loads"] == 1
+    assert all(result[0]["id"] == "b" for result in results)
+
+
+def test_writes_during_a_load_are_replayed(collection):
+    async def run():
+        store = LocalVectorStore(3, max_owners=4)
+        search = asyncio.create_task(store.search(OWNER, unit(0, 0, 1), k=5))
+        await asyncio.sleep(0)
+        store.upsert(OWNER, "new", unit(0, 0, 1))
+        store.remove(OWNER, "a")
+        return await search
+
+    results = asyncio.run(run())
+    assert [result["id"] for result in results][0] == "new"
+    assert "a" not in {result["id"] for result in results}
+
+
+def test_writes_for_unloaded_owners_are_ignored(collection):
+    store = LocalVectorStore(3, max_owners=4)
+    store.upsert(OWNER, "new", unit(1, 1, 1))
+    store.remove(OWNER, "a")
+    assert store.stats()["owners_loaded"] == 0
+
+
+def test_least_recently_used_owner_is_evicted(collection):
+    async def run():
+        store = LocalVectorStore(3, max_owners=1)
+        await store.search(OWNER, unit(1, 0, 0), k=1)
+        await store.search(OTHER_OWNER, unit(1, 0, 0), k=1)
+        return store
+
+    store = asyncio.run(run())
+    assert list(store.owners) == [OTHER_OWNER]
+    assert store.stats()["loads"] == 2
@@ -0,0 +1,94 @@
+import asyncio
+
+import src.rag.ingest as ingest
+from src.rag.queue import IngestQueue
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self.ops.append((name, args + tuple(kwargs.values())))
+
+        return record
+
+    async def execute(self):
+        self.redis.log.extend(self.ops)
+        self.ops = []
+
+
+class FakeRedis:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.log = []
+
+    async def xgroup_create(self, *args, **kwargs):
+        pass
+
+    async def xautoclaim(self, *args, **kwargs):
+        return [b"0-0", [], []]
+
+    async def xreadgroup(self, group, consumer, streams, count, block):
+        if not self.messages:
+            await asyncio.sleep(block / 1000)
+            return []
+        return [[b"stream", [self.messages.pop(0)]]]
+
+    async def zrangebyscore(self, *args, **kwargs):
+        return []
+
+    def register_script(self, script):
+        async def run(keys, args):
+            return 0
+
+        return run
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def calls(self, name):
+        return [args for op, args in self.log if op == name]
+
+
+def make_queue(shutdown_grace):
+    return IngestQueue("test:", 1, 5, 1, 1, 60_000, 10, 60, 60, shutdown_grace)
+
+
+def run_until_stopped(monkeypatch, ingest_seconds, shutdown_grace):
+    async def fake_ingest(r_client, fs, file_id):
+        await asyncio.sleep(ingest_seconds)
+
+    monkeypatch.setattr(ingest, "ingest_file_to_redis", fake_ingest)
+    r_client = FakeRedis([(b"1-0", {b"file_id": b"f1", b"attempts": b"2"})])
+    queue = make_queue(shutdown_grace)
+
+    async def run():
+        await queue.start(r_client, fs=None)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(run())
+    return queue, r_client
+
+
+def test_stop_lets_the_current_job_finish(monkeypatch):
+    queue, r_client = run_until_stopped(monkeypatch, 0.1, shutdown_grace=5)
+
+    assert queue.processed == 1
+    assert r_client.calls("xadd") == []
+    assert r_client.calls("xack") == [("test:jobs", "ingest", b"1-0")]
+    assert r_client.calls("hset")[-1][1]["state"] == "done"
+
+
+def test_stop_hands_back_a_job_past_the_grace_period(monkeypatch):
+    queue, r_client = run_until_stopped(monkeypatch, 60, shutdown_grace=0.05)
+
+    assert queue.processed == 0
+    assert r_client.calls("xadd") == [("test:jobs", {"file_id": "f1", "attempts": 2})]
+    assert r_client.calls("xack") == [("test:jobs", "ingest", b"1-0")]
+    status = r_client.calls("hset")[-1][1]
+    assert status["state"] == "queued"
+    assert status["attempts"] == 2
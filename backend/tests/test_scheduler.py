@@ -0,0 +1,79 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.rag.scheduler import EmbeddingScheduler
+
+
+def make_scheduler(window_ms=20, max_batch=32, fail=False):
+    calls = []
+
+    async def encode(texts):
+        calls.append(list(texts))
+        if fail:
+            raise RuntimeError("model unavailable")
+        return np.array([[len(text), i] for i, text in enumerate(texts)], np.float32)
+
+    return EmbeddingScheduler(encode, 2, window_ms, max_batch), calls
+
+
+def test_concurrent_submits_share_one_batch():
+    async def run():
+        scheduler, calls = make_scheduler()
+        results = await asyncio.gather(
+            scheduler.submit("a"),
+            scheduler.submit(["bb", "ccc"]),
+            scheduler.submit(["dddd"]),
+        )
+        return scheduler, calls, results
+
+    scheduler, calls, results = asyncio.run(run())
+    assert calls == [["a", "bb", "ccc", "dddd"]]
+    assert [result[:, 0].tolist() for result in results] == [[1], [2, 3], [4]]
+    assert scheduler.stats()["requests"] == 3
+    assert scheduler.stats()["batches"] == 1
+
+
+def test_max_batch_closes_the_window_early():
+    async def run():
+        scheduler, calls = make_scheduler(window_ms=1000, max_batch=2)
+        await asyncio.wait_for(
+            asyncio.gather(*(scheduler.submit(str(i)) for i in range(4))), 1
+        )
+        return calls
+
+    assert asyncio.run(run()) == [["0", "1"], ["2", "3"]]
+
+
+def test_empty_submit_skips_the_model():
+    async def run():
+        scheduler, calls = make_scheduler()
+        return await scheduler.submit([]), calls
+
+    result, calls = asyncio.run(run())
+    assert result.shape == (0, 2)
+    assert calls == []
+
+
+def test_encode_errors_reach_every_waiter():
+    async def run():
+        scheduler, _ = make_scheduler(fail=True)
+        return await asyncio.gather(
+            scheduler.submit("a"), scheduler.submit("b"), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_worker_survives_a_failed_batch():
+    async def run():
+        scheduler, calls = make_scheduler(fail=True)
+        with pytest.raises(RuntimeError):
+            await scheduler.submit("a")
+        with pytest.raises(RuntimeError):
+            await scheduler.submit("b")
+        return calls
+
+    assert asyncio.run(run()) == [["a"], ["b"]]
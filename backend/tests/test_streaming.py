@@ -0,0 +1,215 @@
+import asyncio
+import io
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from gridfs.errors import NoFile
+
+from src.utils.streaming import (
+    etag_matches,
+    iter_gridfs_file,
+    parse_byte_range,
+    stream_zip,
+)
+
+
+class FakeGridOut:
+    def __init__(self, data: bytes, chunk_size: int = 4):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    async def seek(self, position):
+        self.position = position
+
+    async def readchunk(self):
+        # like GridOut, never read past the end of the current chunk
+        end = (self.position // self.chunk_size + 1) * self.chunk_size
+        chunk = self.data[self.position : end]
+        self.position += len(chunk)
+        return chunk
+
+
+class FailingGridOut(FakeGridOut):
+    def __init__(self, data: bytes, fail_at: int):
+        super().__init__(data)
+        self.fail_at = fail_at
+
+    async def readchunk(self):
+        if self.position >= self.fail_at:
+            raise ConnectionError("GridFS read failed")
+        return await super().readchunk()
+
+
+class FakeFS:
+    def __init__(self, blobs, failing=None):
+        self.blobs = blobs
+        self.failing = failing or {}
+
+    async def open_download_stream(self, gridfs_id):
+        if gridfs_id in self.failing:
+            return FailingGridOut(self.blobs[gridfs_id], self.failing[gridfs_id])
+        if gridfs_id not in self.blobs:
+            raise NoFile(gridfs_id)
+        return FakeGridOut(self.blobs[gridfs_id])
+
+
+def file_doc(gridfs_id, file_type="text/plain", size=0):
+    return SimpleNamespace(
+        gridfs_id=str(gridfs_id) if gridfs_id else None,
+        file_type=file_type,
+        file_size=size,
+    )
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_iter_gridfs_file_reads_whole_file_and_ranges():
+    data = b"0123456789abcdef"
+
+    def read(start=0, end=None):
+        return b"".join(
+            asyncio.run(_collect(iter_gridfs_file(FakeGridOut(data), start, end)))
+        )
+
+    assert read() == data
+    assert read(5) == data[5:]
+    assert read(3, 9) == data[3:10]
+    assert read(15, 15) == b"f"
+
+
+def test_stream_zip_archives_every_readable_file():
+    text_id, pdf_id, missing_id = ObjectId(), ObjectId(), ObjectId()
+    text = b"plain text " * 50
+    pdf = b"%PDF-1.4 fake pdf body"
+    fs = FakeFS({text_id: text, pdf_id: pdf})
+
+    async def entries():
+        yield "docs/notes.txt", file_doc(text_id, size=len(text))
+        yield "docs/report.pdf", file_doc(pdf_id, "application/pdf", len(pdf))
+        yield "docs/missing.txt", file_doc(missing_id)
+        yield "docs/empty.txt", file_doc(None)
+
+    parts = asyncio.run(_collect(stream_zip(fs, entries())))
+    assert len(parts) > 1
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(parts))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["docs/notes.txt", "docs/report.pdf"]
+        assert archive.read("docs/notes.txt") == text
+        assert archive.read("docs/report.pdf") == pdf
+        assert archive.getinfo("docs/notes.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo("docs/report.pdf").compress_type == zipfile.ZIP_STORED
+
+
+def test_stream_zip_skips_files_that_fail_before_their_first_byte():
+    good_id, broken_id = ObjectId(), ObjectId()
+    fs = FakeFS({good_id: b"kept", broken_id: b"never read"}, {broken_id: 0})
+
+    async def entries():
+        yield "broken.txt", file_doc(broken_id)
+        yield "good.txt", file_doc(good_id)
+
+    parts = asyncio.run(_collect(stream_zip(fs, entries())))
+    with zipfile.ZipFile(io.BytesIO(b"".join(parts))) as archive:
+        assert archive.namelist() == ["good.txt"]
+        assert archive.read("good.txt") == b"kept"
+
+
+def test_stream_zip_aborts_when_a_file_fails_mid_read():
+    broken_id = ObjectId()
+    fs = FakeFS({broken_id: b"x" * 64}, {broken_id: 8})
+
+    async def entries():
+        yield "broken.txt", file_doc(broken_id)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(_collect(stream_zip(fs, entries())))
+
+
+def test_stream_zip_with_no_entries_is_a_valid_empty_archive():
+    async def entries():
+        return
+        yield
+
+    parts = asyncio.run(_collect(stream_zip(FakeFS({}), entries())))
+    with zipfile.ZipFile(io.BytesIO(b"".join(parts))) as archive:
+        assert archive.namelist() == []
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=10-19", (10, 19)),
+        ("bytes=90-", (90, 99)),
+        ("bytes=90-500", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-500", (0, 99)),
+        ("bytes=99-99", (99, 99)),
+    ],
+)
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    [None, "", "items=0-10", "bytes=0-10,20-30", "bytes=abc-", "bytes=5", "bytes=-"],
+)
+def test_parse_byte_range_falls_back_to_the_full_body(header):
+    assert parse_byte_range(header, 100) is None
+
+
+@pytest.mark.parametrize(
+    "header, size", [("bytes=100-", 100), ("bytes=-0", 100), ("bytes=0-", 0)]
+)
+def test_parse_byte_range_rejects_unsatisfiable_ranges(header, size):
+    with pytest.raises(HTTPException) as error:
+        parse_byte_range(header, size)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+def test_etag_matches():
+    etag = '"abc123"'
+    assert etag_matches('"abc123"', etag)
+    assert etag_matches('"zzz", W/"abc123"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"zzz"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_file_downloads_skip_gzip():
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    from src.middleware.compression import SelectiveGZipMiddleware
+    from src.utils.constants import GZIP_EXCLUDED_PATHS
+
+    async def body(request):
+        return PlainTextResponse("x" * 5000)
+
+    app = Starlette(
+        routes=[Route("/file/{id}", body), Route("/file/{id}/ingest", body)]
+    )
+    app.add_middleware(
+        SelectiveGZipMiddleware, minimum_size=1000, exclude_paths=GZIP_EXCLUDED_PATHS
+    )
+    client = TestClient(app)
+    headers = {"Accept-Encoding": "gzip"}
+
+    download = client.get("/file/abc", headers=headers)
+    assert "content-encoding" not in download.headers
+    assert len(download.content) == 5000
+    assert (
+        client.get("/file/abc/ingest", headers=headers).headers["content-encoding"]
+        == "gzip"
+    )
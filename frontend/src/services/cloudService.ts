@@ -49,6 +49,7 @@ export const uploadItems = async(
     path: paths[index]
   }));
 
+  const batchId = crypto.randomUUID();
   const smallFiles = filesWithPaths.filter((f) => f.file.size < CHUNK_SIZE);
   const largeFiles = filesWithPaths.filter((f) => f.file.size >= CHUNK_SIZE);
   const uploadPromises: Promise<any>[] = [];
@@ -77,7 +78,8 @@ export const uploadItems = async(
         file_name: fileName,
         total_chunks: totalChunks,
         parent_folder_id: parentFolderId,
-        file_path: item.path
+        file_path: item.path,
+        batch_id: batchId
       })
     );
     uploadPromises.push(finalPromise);
@@ -93,6 +95,7 @@ export const uploadItems = async(
     if (parentFolderId) {
       formData.append("parent_folder_id", parentFolderId);
     }
+    formData.append("batch_id", batchId);
     uploadPromises.push(
       api.post("/bulk/upload", formData, {
         headers: { "Content-Type": "multipart/form-data" }